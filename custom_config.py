@@ -15,6 +15,12 @@ CROP_MODE = True
 MIN_CROPS= 2
 MAX_CROPS= 6 # max:9; If your GPU memory is small, it is recommended to set it to 6.
 MAX_CONCURRENCY = 100 # If you have limited GPU memory, lower the concurrency count.
+MAX_NUM_BATCHED_TOKENS = None # vLLM scheduler token budget per step; None lets vLLM derive it from max_model_len
+BLOCK_SIZE = 256 # KV-cache block size (tokens per block)
+ENFORCE_EAGER = False # False keeps vLLM's CUDA-graph capture for the decode step; True only for debugging
+QUANTIZATION = None # 'fp8' quantizes weights on load (needs compute capability >= 8.9); 'awq'/'gptq' need a pre-quantized MODEL_PATH
+KV_CACHE_DTYPE = 'auto' # 'fp8' halves KV-cache memory, leaving room for a higher MAX_CONCURRENCY
+TENSOR_PARALLEL_SIZE = 0 # 0 = shard across every visible GPU; the extra KV cache is what lets MAX_CONCURRENCY go higher
 NUM_WORKERS = 64 # image pre-process (resize/padding) workers 
 PRINT_NUM_VIS_TOKENS = False
 SKIP_REPEAT = True
@@ -42,6 +48,21 @@ PROMPT = '<image>\n<|grounding|>Convert the document to markdown.'
 # '先天下之忧而忧'
 # .......
 
-from transformers import AutoTokenizer
+def resolve_quantization(quantization):
+    """Fall back to unquantized weights when FP8 is requested on a GPU without FP8 support"""
+    import torch
+    if quantization == 'fp8' and torch.cuda.get_device_capability() < (8, 9):
+        print(f"FP8 quantization needs compute capability >= 8.9, got {torch.cuda.get_device_capability()}; "
+              f"loading unquantized weights")
+        return None
+    return quantization
 
-TOKENIZER = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
\ No newline at end of file
+def __getattr__(name):
+    # TOKENIZER is loaded on first access (PEP 562), so importing this module for
+    # its constants doesn't pull in transformers or read the tokenizer files
+    if name == 'TOKENIZER':
+        global TOKENIZER
+        from transformers import AutoTokenizer
+        TOKENIZER = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
+        return TOKENIZER
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
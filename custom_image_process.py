@@ -1,12 +1,14 @@
 import math
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+import numpy as np
 import torch
 import torchvision.transforms as T
 from PIL import Image, ImageOps
 from transformers import AutoProcessor, BatchFeature, LlamaTokenizerFast
 from transformers.processing_utils import ProcessorMixin
-from config import IMAGE_SIZE, BASE_SIZE, CROP_MODE, MIN_CROPS, MAX_CROPS, PROMPT, TOKENIZER
+import config
+from config import IMAGE_SIZE, BASE_SIZE, CROP_MODE, MIN_CROPS, MAX_CROPS, PROMPT
 
 def find_closest_aspect_ratio(aspect_ratio, target_ratios, width, height, image_size):
     best_ratio_diff = float('inf')
@@ -102,9 +104,24 @@ class ImageTransform:
 
         self.transform = T.Compose(transform_pipelines)
 
-    def __call__(self, pil_img: Image.Image):
-        x = self.transform(pil_img)
-        return x
+        # ToTensor + Normalize folded into one per-channel scale and shift:
+        # (x / 255 - mean) / std == x * scale + shift
+        std_t = torch.tensor(std if normalize else (1.0, 1.0, 1.0), dtype=torch.float32).view(3, 1, 1)
+        mean_t = torch.tensor(mean if normalize else (0.0, 0.0, 0.0), dtype=torch.float32).view(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std_t)
+        self.shift = -mean_t / std_t
+
+    def __call__(self, pil_img: Image.Image, out: Optional[torch.Tensor] = None):
+        if pil_img.mode != 'RGB':
+            x = self.transform(pil_img)
+            return x if out is None else out.copy_(x)
+
+        # uint8 HWC -> float CHW in a single copy, then scale/shift in place
+        pixels = torch.from_numpy(np.array(pil_img))
+        if out is None:
+            out = torch.empty((3, pil_img.height, pil_img.width), dtype=torch.float32)
+        out.copy_(pixels.permute(2, 0, 1))
+        return out.mul_(self.scale).add_(self.shift)
 
 
 class DeepseekOCRProcessor(ProcessorMixin):
@@ -113,7 +130,7 @@ class DeepseekOCRProcessor(ProcessorMixin):
 
     def __init__(
         self,
-        tokenizer: LlamaTokenizerFast = TOKENIZER,
+        tokenizer: LlamaTokenizerFast = None,
         candidate_resolutions: Tuple[Tuple[int, int]] = [[1024, 1024]],
         patch_size: int = 16,
         downsample_ratio: int = 4,
@@ -143,6 +160,9 @@ class DeepseekOCRProcessor(ProcessorMixin):
         self.image_transform = ImageTransform(mean=image_mean, std=image_std, normalize=normalize)
 
 
+        # Default to the shared tokenizer from config, loaded on first use
+        if tokenizer is None:
+            tokenizer = config.TOKENIZER
         self.tokenizer = tokenizer
         # self.tokenizer = add_special_token(tokenizer)
         self.tokenizer.padding_side = 'left'  # must set this，padding side with make a difference in batch inference
@@ -177,6 +197,9 @@ class DeepseekOCRProcessor(ProcessorMixin):
         self.mask_prompt = mask_prompt
         self.ignore_id = ignore_id
 
+        # token ids of prompt text segments, which repeat on every page
+        self._encode_cache = {}
+
         super().__init__(
             tokenizer,
             **kwargs,
@@ -222,7 +245,12 @@ class DeepseekOCRProcessor(ProcessorMixin):
         return self.tokenizer.pad_token_id
 
     def encode(self, text: str, bos: bool = True, eos: bool = False):
-        t = self.tokenizer.encode(text, add_special_tokens=False)
+        cached = self._encode_cache.get(text)
+        if cached is None:
+            if len(self._encode_cache) >= 256:  # arbitrary API prompts must not grow this forever
+                self._encode_cache.clear()
+            cached = self._encode_cache[text] = tuple(self.tokenizer.encode(text, add_special_tokens=False))
+        t = list(cached)
 
         if bos:
             t = [self.bos_id] + t
@@ -400,8 +428,13 @@ class DeepseekOCRProcessor(ProcessorMixin):
                 #     for j in range(0, best_width, self.image_size):
                 #         images_crop_list.append(
                 #             self.image_transform(local_view.crop((j, i, j + self.image_size, i + self.image_size))))
+                # Transform every tile straight into one contiguous (K, 3, H, W) block
+                # so the vision encoder gets a single batch without a restacking copy
+                tile_width, tile_height = images_crop_raw[0].size
+                tiles = torch.empty((len(images_crop_raw), 3, tile_height, tile_width), dtype=torch.float32)
                 for i in range(len(images_crop_raw)):
-                    images_crop_list.append(self.image_transform(images_crop_raw[i]))
+                    self.image_transform(images_crop_raw[i], out=tiles[i])
+                images_crop_list.append(tiles)
 
             # """process the global view"""
             # global_view = ImageOps.pad(image, (self.image_size, self.image_size),
@@ -486,7 +519,10 @@ class DeepseekOCRProcessor(ProcessorMixin):
             pixel_values = torch.stack(images_list, dim=0)
             images_spatial_crop = torch.tensor(images_spatial_crop, dtype=torch.long)
             if images_crop_list:
-                images_crop = torch.stack(images_crop_list, dim=0).unsqueeze(0)
+                if len(images_crop_list) == 1:
+                    images_crop = images_crop_list[0].unsqueeze(0)
+                else:
+                    images_crop = torch.cat(images_crop_list, dim=0).unsqueeze(0)
             else:
                 images_crop = torch.zeros((1, 3, self.image_size, self.image_size)).unsqueeze(0)
 
@@ -0,0 +1,52 @@
+from typing import List, Optional, Set
+
+import torch
+from transformers import LogitsProcessor
+
+
+class NoRepeatNGramLogitsProcessor(LogitsProcessor):
+    """
+    Ban tokens that would repeat an n-gram seen in the last `window_size` output tokens.
+
+    This runs as a Python callback on every decode step, so it is kept cheap:
+    nothing is checked until the output is `min_length` tokens long (short pages
+    cannot be stuck in a repetition loop yet), and window positions are filtered
+    on a single token compare before any n-gram slice is built.
+    """
+
+    def __init__(self, ngram_size: int, window_size: int = 100, whitelist_token_ids: Optional[Set[int]] = None,
+                 min_length: int = 0):
+        if not isinstance(ngram_size, int) or ngram_size <= 0:
+            raise ValueError(f"`ngram_size` has to be a strictly positive integer, but is {ngram_size}")
+        if not isinstance(window_size, int) or window_size <= 0:
+            raise ValueError(f"`window_size` has to be a strictly positive integer, but is {window_size}")
+        self.ngram_size = ngram_size
+        self.window_size = window_size
+        self.whitelist_token_ids = whitelist_token_ids or set()
+        self.min_length = max(min_length, ngram_size)
+
+    def __call__(self, input_ids: List[int], scores: torch.FloatTensor) -> torch.FloatTensor:
+        num_tokens = len(input_ids)
+        if num_tokens < self.min_length:
+            return scores
+
+        prefix_len = self.ngram_size - 1
+        current_prefix = input_ids[num_tokens - prefix_len:]
+        last_token = input_ids[-1] if prefix_len else None
+
+        search_start = max(0, num_tokens - self.window_size)
+        search_end = num_tokens - self.ngram_size + 1
+
+        banned_tokens = set()
+        for i in range(search_start, search_end):
+            # Cheap reject on the token that precedes the candidate before comparing the whole prefix
+            if prefix_len and input_ids[i + prefix_len - 1] != last_token:
+                continue
+            if input_ids[i:i + prefix_len] == current_prefix:
+                banned_tokens.add(input_ids[i + prefix_len])
+
+        banned_tokens -= self.whitelist_token_ids
+        if banned_tokens:
+            scores = scores.clone()
+            scores[list(banned_tokens)] = -float("inf")
+        return scores
@@ -35,7 +35,7 @@ llm = LLM(
     gpu_memory_utilization=0.9,
 )
 
-logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=40, window_size=90, whitelist_token_ids= {128821, 128822})] #window for fast；whitelist_token_ids: <td>,</td>
+logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=40, window_size=90, whitelist_token_ids= {128821, 128822}, min_length=200)] #window for fast；whitelist_token_ids: <td>,</td>
 
 sampling_params = SamplingParams(
     temperature=0.0,
@@ -79,17 +79,22 @@ def re_match(text):
         mathes_other.append(a_match[0])
     return matches, mathes_other
 
+# Shared across all pages/worker threads instead of being rebuilt per image
+processor = DeepseekOCRProcessor()
+
+
 def process_single_image(image, prompt):
     """single image"""
     prompt_in = prompt
     cache_item = {
         "prompt": prompt_in,
-        "multi_modal_data": {"image": DeepseekOCRProcessor().tokenize_with_images(images = [image], bos=True, eos=True, cropping=CROP_MODE)},
+        "multi_modal_data": {"image": processor.tokenize_with_images(prompt=prompt_in, images = [image], bos=True, eos=True, cropping=CROP_MODE)},
     }
     return cache_item
 
 
 def main():
+    global INPUT_PATH, OUTPUT_PATH
     parser = argparse.ArgumentParser(description='Process batch of images with DeepSeek OCR using custom prompt')
     parser.add_argument('--prompt', type=str, help='Custom prompt to use for OCR (overrides default from config)')
     parser.add_argument('--input', type=str, default=INPUT_PATH, help='Input directory path containing images')
@@ -104,10 +109,8 @@ def main():
     
     # Set paths from arguments if provided
     if args.input:
-        global INPUT_PATH
         INPUT_PATH = args.input
     if args.output:
-        global OUTPUT_PATH
         OUTPUT_PATH = args.output
 
     # INPUT_PATH = OmniDocBench images path
@@ -1,4 +1,5 @@
 import asyncio
+import itertools
 import re
 import os
 import argparse
@@ -43,9 +44,11 @@ def load_image(image_path):
             return None
 
 
+_REF_RE = re.compile(r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)', re.DOTALL)
+
+
 def re_match(text):
-    pattern = r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)'
-    matches = re.findall(pattern, text, re.DOTALL)
+    matches = _REF_RE.findall(text)
 
 
     mathes_image = []
@@ -160,7 +163,7 @@ async def stream_generate(image=None, prompt=''):
     )
     engine = AsyncLLMEngine.from_engine_args(engine_args)
     
-    logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=30, window_size=90, whitelist_token_ids= {128821, 128822})] #whitelist: <td>, </td> 
+    logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=30, window_size=90, whitelist_token_ids= {128821, 128822}, min_length=200)] #whitelist: <td>, </td> 
 
     sampling_params = SamplingParams(
         temperature=0.0,
@@ -203,6 +206,7 @@ async def stream_generate(image=None, prompt=''):
 
 
 def main():
+    global INPUT_PATH, OUTPUT_PATH
     parser = argparse.ArgumentParser(description='Process image with DeepSeek OCR using custom prompt')
     parser.add_argument('--prompt', type=str, help='Custom prompt to use for OCR (overrides default from config)')
     parser.add_argument('--input', type=str, default=INPUT_PATH, help='Input image file path')
@@ -217,10 +221,8 @@ def main():
     
     # Set paths from arguments if provided
     if args.input:
-        global INPUT_PATH
         INPUT_PATH = args.input
     if args.output:
-        global OUTPUT_PATH
         OUTPUT_PATH = args.output
 
     os.makedirs(OUTPUT_PATH, exist_ok=True)
@@ -231,7 +233,7 @@ def main():
     
     if '<image>' in prompt:
 
-        image_features = DeepseekOCRProcessor().tokenize_with_images(images = [image], bos=True, eos=True, cropping=CROP_MODE)
+        image_features = DeepseekOCRProcessor().tokenize_with_images(prompt=prompt, images = [image], bos=True, eos=True, cropping=CROP_MODE)
     else:
         image_features = ''
 
@@ -255,11 +257,12 @@ def main():
         result = process_image_with_refs(image_draw, matches_ref)
 
 
-        for idx, a_match_image in enumerate(tqdm(matches_images, desc="image")):
-            outputs = outputs.replace(a_match_image, f'![](images/' + str(idx) + '.jpg)\n')
-
-        for idx, a_match_other in enumerate(tqdm(mathes_other, desc="other")):
-            outputs = outputs.replace(a_match_other, '').replace('\\coloneqq', ':=').replace('\\eqqcolon', '=:')
+        # Rewrite all refs in one pass: image refs become links, the others are dropped
+        img_idx = itertools.count()
+        outputs = _REF_RE.sub(
+            lambda m: f'![](images/{next(img_idx)}.jpg)\n' if m.group(2) == 'image' else '',
+            outputs
+        ).replace('\\coloneqq', ':=').replace('\\eqqcolon', '=:')
 
         # if 'structural formula' in conversation[0]['content']:
         #     outputs = '<smiles>' + outputs + '</smiles>'
@@ -3,6 +3,7 @@ import fitz
 import img2pdf
 import io
 import re
+import itertools
 import argparse
 from tqdm import tqdm
 import torch
@@ -12,10 +13,12 @@ from concurrent.futures import ThreadPoolExecutor
 if torch.version.cuda == '11.8':
     os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
 os.environ['VLLM_USE_V1'] = '0'
-os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", '0')
 
 
-from config import MODEL_PATH, INPUT_PATH, OUTPUT_PATH, PROMPT, SKIP_REPEAT, MAX_CONCURRENCY, NUM_WORKERS, CROP_MODE
+from config import (MODEL_PATH, INPUT_PATH, OUTPUT_PATH, PROMPT, SKIP_REPEAT, MAX_CONCURRENCY, NUM_WORKERS, CROP_MODE,
+                    MAX_NUM_BATCHED_TOKENS, BLOCK_SIZE, TENSOR_PARALLEL_SIZE, ENFORCE_EAGER,
+                    QUANTIZATION, KV_CACHE_DTYPE, resolve_quantization)
 
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
@@ -29,22 +32,30 @@ from process.image_process import DeepseekOCRProcessor
 
 ModelRegistry.register_model("DeepseekOCRForCausalLM", DeepseekOCRForCausalLM)
 
+Image.MAX_IMAGE_PIXELS = None
+
+
+def build_llm(max_num_seqs=MAX_CONCURRENCY, max_num_batched_tokens=MAX_NUM_BATCHED_TOKENS, block_size=BLOCK_SIZE,
+              tensor_parallel_size=TENSOR_PARALLEL_SIZE, enforce_eager=ENFORCE_EAGER,
+              quantization=QUANTIZATION, kv_cache_dtype=KV_CACHE_DTYPE):
+    return LLM(
+        model=MODEL_PATH,
+        hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
+        block_size=block_size,
+        enforce_eager=enforce_eager,
+        trust_remote_code=True, 
+        max_model_len=8192,
+        swap_space=0,
+        max_num_seqs=max_num_seqs,
+        max_num_batched_tokens=max_num_batched_tokens,
+        tensor_parallel_size=tensor_parallel_size or torch.cuda.device_count(),
+        quantization=resolve_quantization(quantization),
+        kv_cache_dtype=kv_cache_dtype,
+        gpu_memory_utilization=0.9,
+        disable_mm_preprocessor_cache=True
+    )
 
-llm = LLM(
-    model=MODEL_PATH,
-    hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
-    block_size=256,
-    enforce_eager=False,
-    trust_remote_code=True, 
-    max_model_len=8192,
-    swap_space=0,
-    max_num_seqs=MAX_CONCURRENCY,
-    tensor_parallel_size=1,
-    gpu_memory_utilization=0.9,
-    disable_mm_preprocessor_cache=True
-)
-
-logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=20, window_size=50, whitelist_token_ids= {128821, 128822})] #window for fast；whitelist_token_ids: <td>,</td>
+logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=20, window_size=50, whitelist_token_ids= {128821, 128822}, min_length=200)] #window for fast；whitelist_token_ids: <td>,</td>
 
 sampling_params = SamplingParams(
     temperature=0.0,
@@ -62,7 +73,7 @@ class Colors:
     BLUE = '\033[34m'
     RESET = '\033[0m' 
 
-def pdf_to_images_high_quality(pdf_path, dpi=144, image_format="PNG"):
+def pdf_to_images_high_quality(pdf_path, dpi=144):
     """
     pdf2images
     """
@@ -73,22 +84,12 @@ def pdf_to_images_high_quality(pdf_path, dpi=144, image_format="PNG"):
     zoom = dpi / 72.0
     matrix = fitz.Matrix(zoom, zoom)
     
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
+    for page in pdf_document:
 
+        # alpha=False gives tightly packed RGB samples, so wrap them directly
+        # instead of round-tripping through a PNG encode/decode
         pixmap = page.get_pixmap(matrix=matrix, alpha=False)
-        Image.MAX_IMAGE_PIXELS = None
-
-        if image_format.upper() == "PNG":
-            img_data = pixmap.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-        else:
-            img_data = pixmap.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            if img.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
+        img = Image.frombuffer("RGB", (pixmap.width, pixmap.height), pixmap.samples, "raw", "RGB", 0, 1)
         
         images.append(img)
     
@@ -121,9 +122,12 @@ def pil_to_pdf_img2pdf(pil_images, output_path):
 
 
 
+_REF_RE = re.compile(r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)', re.DOTALL)
+_NEWLINES_RE = re.compile(r'\n{3,}')
+
+
 def re_match(text):
-    pattern = r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)'
-    matches = re.findall(pattern, text, re.DOTALL)
+    matches = _REF_RE.findall(text)
 
 
     mathes_image = []
@@ -136,6 +140,20 @@ def re_match(text):
     return matches, mathes_image, mathes_other
 
 
+def replace_refs(text, jdx):
+    """Turn image refs into markdown links and drop the other refs in a single pass"""
+    img_idx = itertools.count()
+
+    def _repl(match):
+        if match.group(2) == 'image':
+            return f'![](images/{jdx}_{next(img_idx)}.jpg)\n'
+        return ''
+
+    text = _REF_RE.sub(_repl, text)
+    text = text.replace('\\coloneqq', ':=').replace('\\eqqcolon', '=:')
+    return _NEWLINES_RE.sub('\n\n', text)
+
+
 def extract_coordinates_and_label(ref_text, image_width, image_height):
 
 
@@ -221,21 +239,39 @@ def process_image_with_refs(image, ref_texts, jdx):
     return result_image
 
 
+# Shared across all pages/worker threads instead of being rebuilt per image
+processor = DeepseekOCRProcessor()
+
+
 def process_single_image(image, prompt):
     """single image"""
     prompt_in = prompt
     cache_item = {
         "prompt": prompt_in,
-        "multi_modal_data": {"image": DeepseekOCRProcessor().tokenize_with_images(images = [image], bos=True, eos=True, cropping=CROP_MODE)},
+        "multi_modal_data": {"image": processor.tokenize_with_images(prompt=prompt_in, images = [image], bos=True, eos=True, cropping=CROP_MODE)},
     }
     return cache_item
 
 
 def main():
+    global INPUT_PATH, OUTPUT_PATH
     parser = argparse.ArgumentParser(description='Process PDF with DeepSeek OCR using custom prompt')
     parser.add_argument('--prompt', type=str, help='Custom prompt to use for OCR (overrides default from config)')
     parser.add_argument('--input', type=str, default=INPUT_PATH, help='Input PDF file path')
     parser.add_argument('--output', type=str, default=OUTPUT_PATH, help='Output directory path')
+    parser.add_argument('--max-num-seqs', type=int, default=MAX_CONCURRENCY,
+                        help='Maximum number of pages decoded concurrently by vLLM')
+    parser.add_argument('--max-num-batched-tokens', type=int, default=MAX_NUM_BATCHED_TOKENS,
+                        help='Maximum number of tokens scheduled per engine step')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='KV-cache block size')
+    parser.add_argument('--tensor-parallel-size', type=int, default=TENSOR_PARALLEL_SIZE,
+                        help='Number of GPUs to shard the model across (0 = all visible GPUs). '
+                             'Gains come from the extra KV cache, so raise --max-num-seqs with it')
+    parser.add_argument('--cudagraph', action=argparse.BooleanOptionalAction, default=not ENFORCE_EAGER,
+                        help='Capture CUDA graphs for the decode step (--no-cudagraph runs eagerly)')
+    parser.add_argument('--quantization', type=str, default=QUANTIZATION, choices=['fp8', 'awq', 'gptq'],
+                        help='Weight quantization; fp8 needs compute capability >= 8.9, awq/gptq need a pre-quantized model')
+    parser.add_argument('--kv-cache-dtype', type=str, default=KV_CACHE_DTYPE, help="KV-cache dtype, e.g. 'auto' or 'fp8'")
     
     args = parser.parse_args()
     
@@ -246,10 +282,8 @@ def main():
     
     # Set paths from arguments if provided
     if args.input:
-        global INPUT_PATH
         INPUT_PATH = args.input
     if args.output:
-        global OUTPUT_PATH
         OUTPUT_PATH = args.output
 
     os.makedirs(OUTPUT_PATH, exist_ok=True)
@@ -281,6 +315,16 @@ def main():
     #     batch_inputs.extend(cache_list)
 
 
+    llm = build_llm(
+        max_num_seqs=args.max_num_seqs,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        block_size=args.block_size,
+        tensor_parallel_size=args.tensor_parallel_size,
+        enforce_eager=not args.cudagraph,
+        quantization=args.quantization,
+        kv_cache_dtype=args.kv_cache_dtype
+    )
+
     outputs_list = llm.generate(
         batch_inputs,
         sampling_params=sampling_params
@@ -295,51 +339,41 @@ def main():
     mmd_det_path = output_path + '/' + INPUT_PATH.split('/')[-1].replace('.pdf', '_det.mmd')
     mmd_path = output_path + '/' + INPUT_PATH.split('/')[-1].replace('pdf', 'mmd')
     pdf_out_path = output_path + '/' + INPUT_PATH.split('/')[-1].replace('.pdf', '_layouts.pdf')
-    contents_det = ''
-    contents = ''
     draw_images = []
     jdx = 0
-    for output, img in zip(outputs_list, images):
-        content = output.outputs[0].text
-
-        if '<｜end▁of▁sentence｜>' in content: # repeat no eos
-            content = content.replace('<｜end▁of▁sentence｜>', '')
-        else:
-            if SKIP_REPEAT:
-                continue
-
-        
-        page_num = f'\n<--- Page Split --->'
-
-        contents_det += content + f'\n{page_num}\n'
+    # Write each page as soon as it is post-processed instead of accumulating the whole document
+    with open(mmd_det_path, 'w', encoding='utf-8') as det_file, open(mmd_path, 'w', encoding='utf-8') as mmd_file:
+        for output, img in zip(outputs_list, images):
+            content = output.outputs[0].text
 
-        image_draw = img.copy()
+            if '<｜end▁of▁sentence｜>' in content: # repeat no eos
+                content = content.replace('<｜end▁of▁sentence｜>', '')
+            else:
+                if SKIP_REPEAT:
+                    continue
 
-        matches_ref, matches_images, mathes_other = re_match(content)
-        # print(matches_ref)
-        result_image = process_image_with_refs(image_draw, matches_ref, jdx)
+            
+            page_num = f'\n<--- Page Split --->'
 
+            det_file.write(content + f'\n{page_num}\n')
 
-        draw_images.append(result_image)
+            image_draw = img.copy()
 
+            matches_ref, matches_images, mathes_other = re_match(content)
+            # print(matches_ref)
+            result_image = process_image_with_refs(image_draw, matches_ref, jdx)
 
-        for idx, a_match_image in enumerate(matches_images):
-            content = content.replace(a_match_image, f'![](images/' + str(jdx) + '_' + str(idx) + '.jpg)\n')
 
-        for idx, a_match_other in enumerate(mathes_other):
-            content = content.replace(a_match_other, '').replace('\\coloneqq', ':=').replace('\\eqqcolon', '=:').replace('\n\n\n\n', '\n\n').replace('\n\n\n', '\n\n')
+            draw_images.append(result_image)
 
 
-        contents += content + f'\n{page_num}\n'
+            content = replace_refs(content, jdx)
 
 
-        jdx += 1
+            mmd_file.write(content + f'\n{page_num}\n')
 
-    with open(mmd_det_path, 'w', encoding='utf-8') as afile:
-        afile.write(contents_det)
 
-    with open(mmd_path, 'w', encoding='utf-8') as afile:
-        afile.write(contents)
+            jdx += 1
 
 
     pil_to_pdf_img2pdf(draw_images, pdf_out_path)
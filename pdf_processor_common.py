@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the PDF processor scripts (pdf_to_*.py)
+
+Holds the setup every processor needs in the same form, so it is defined once.
+"""
+
+import logging
+import logging.handlers
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson  # Optional: decodes large multi-page API responses faster than json
+except ImportError:
+    orjson = None
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def setup_logging(log_file: str = 'pdf_processor.log') -> None:
+    """
+    Log to the console and to a log file
+
+    The log file is written in batches (every 100 records, on errors and at exit)
+    rather than flushed after every line.
+
+    Args:
+        log_file: Path of the log file
+    """
+    log_file_handler = logging.FileHandler(log_file)
+    log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        handlers=[
+            logging.handlers.MemoryHandler(100, flushLevel=logging.ERROR, target=log_file_handler),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def create_session() -> requests.Session:
+    """
+    Create a pooled keep-alive session for calls to the OCR API
+
+    Reusing connections lets repeated uploads skip the TCP/TLS handshake.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_json(response: requests.Response):
+    """Decode a JSON API response, with orjson when it is installed"""
+    return orjson.loads(response.content) if orjson else response.json()
+
+
+def is_up_to_date(output_path: Path, *source_paths: Path) -> bool:
+    """
+    Check whether an output file was written after its sources last changed
+
+    Args:
+        output_path: Path to the converted output file
+        source_paths: Files the output is built from (the PDF, a prompt file);
+            sources that do not exist are ignored
+
+    Returns:
+        True if the output can be reused as is
+    """
+    if not output_path.exists():
+        return False
+    source_mtime = max((path.stat().st_mtime for path in source_paths if path.exists()), default=0)
+    return output_path.stat().st_mtime >= source_mtime
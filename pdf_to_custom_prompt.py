@@ -20,15 +20,10 @@ import yaml
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 
+from pdf_processor_common import create_session, is_up_to_date, parse_json, setup_logging
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('pdf_processor.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -57,6 +52,9 @@ class PDFToCustomPromptProcessor:
         self.data_folder = Path(data_folder)
         self.data_folder.mkdir(exist_ok=True)
         self.api_base_url = api_base_url
+        
+        # One pooled keep-alive session for every call to the API
+        self.session = create_session()
         self.custom_prompt_file = custom_prompt_file
         
         # Load custom prompt from YAML file
@@ -102,7 +100,7 @@ class PDFToCustomPromptProcessor:
     def _test_api_connection(self) -> bool:
         """Test if the API is accessible"""
         try:
-            response = requests.get(f"{self.api_base_url}/docs", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/docs", timeout=5)
             if response.status_code == 200:
                 logger.info("API connection successful")
                 return True
@@ -116,7 +114,7 @@ class PDFToCustomPromptProcessor:
     def _get_api_endpoints(self) -> Dict[str, str]:
         """Get available API endpoints"""
         try:
-            response = requests.get(f"{self.api_base_url}/openapi.json", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/openapi.json", timeout=5)
             if response.status_code == 200:
                 openapi_spec = response.json()
                 endpoints = {}
@@ -158,10 +156,10 @@ class PDFToCustomPromptProcessor:
                 # Use custom prompt from YAML file
                 data = {'prompt': self.custom_prompt}
                 
-                response = requests.post(url, files=files, data=data, timeout=300)
+                response = self.session.post(url, files=files, data=data, timeout=300)
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    result = parse_json(response)
                     logger.info(f"Successfully processed PDF using endpoint: {endpoint}")
                     
                     # Extract markdown content from BatchOCRResponse
@@ -169,16 +167,15 @@ class PDFToCustomPromptProcessor:
                         # Check if this is a batch response with results
                         if "results" in result and isinstance(result["results"], list):
                             # Combine all page results into a single markdown
-                            markdown_content = ""
-                            for page_result in result["results"]:
-                                if isinstance(page_result, dict) and "result" in page_result:
-                                    page_content = page_result["result"]
-                                    if page_content:
-                                        markdown_content += page_content + "\n\n<--- Page Split --->\n\n"
+                            markdown_content = "".join(
+                                page_result["result"] + "\n\n<--- Page Split --->\n\n"
+                                for page_result in result["results"]
+                                if isinstance(page_result, dict) and page_result.get("result")
+                            )
                             return markdown_content.strip()
                         
                         # Try common response field names
-                        for field in ["markdown", "content", "text", "result", "output"]:
+                        for field in ("markdown", "content", "text", "result", "output"):
                             if field in result:
                                 return result[field]
                         
@@ -194,17 +191,27 @@ class PDFToCustomPromptProcessor:
             logger.error(f"Error processing {pdf_path}: {str(e)}")
             return None
     
-    def convert_pdf_to_markdown(self, pdf_path: str) -> Optional[str]:
+    def convert_pdf_to_markdown(self, pdf_path: str, force: bool = False) -> Optional[str]:
         """
         Convert a single PDF file to Markdown
         
         Args:
             pdf_path: Path to the PDF file
+            force: Convert again even if the output file is newer than the PDF
             
         Returns:
             Path to the generated Markdown file, or None if conversion failed
         """
         try:
+            # Output markdown file with -CUSTOM suffix
+            pdf_path_obj = Path(pdf_path)
+            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-CUSTOM.md")
+            
+            # Skip PDFs that have not changed since they were last converted
+            if not force and is_up_to_date(markdown_path, pdf_path_obj, Path(self.custom_prompt_file)):
+                logger.info(f"Skipping {pdf_path}: {markdown_path} is up to date")
+                return str(markdown_path)
+            
             logger.info(f"Processing PDF: {pdf_path}")
             
             # Call OCR API
@@ -214,10 +221,6 @@ class PDFToCustomPromptProcessor:
                 logger.error(f"Failed to get markdown content for {pdf_path}")
                 return None
             
-            # Save markdown file with -CUSTOM suffix
-            pdf_path_obj = Path(pdf_path)
-            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-CUSTOM.md")
-            
             with open(markdown_path, 'w', encoding='utf-8') as f:
                 f.write(markdown_content)
             
@@ -228,15 +231,21 @@ class PDFToCustomPromptProcessor:
             logger.error(f"Error converting {pdf_path}: {str(e)}")
             return None
     
-    def scan_and_process_all_pdfs(self) -> List[str]:
+    def scan_and_process_all_pdfs(self, force: bool = False) -> List[str]:
         """
         Scan the data folder for PDF files and convert all of them to Markdown
         
+        Args:
+            force: Convert every PDF again, including ones whose output is up to date
+        
         Returns:
             List of paths to generated Markdown files
         """
-        # Find all PDF files in the data folder
-        pdf_files = list(self.data_folder.glob("*.pdf"))
+        # Find all PDF files in the data folder (any case of the .pdf extension),
+        # largest first so the slowest conversions don't end up in the tail
+        pdf_files = [path for path in self.data_folder.iterdir()
+                     if path.suffix.lower() == '.pdf' and path.is_file()]
+        pdf_files.sort(key=lambda path: path.stat().st_size, reverse=True)
         
         if not pdf_files:
             logger.info(f"No PDF files found in {self.data_folder}")
@@ -246,7 +255,7 @@ class PDFToCustomPromptProcessor:
         
         markdown_files = []
         for pdf_file in pdf_files:
-            markdown_file = self.convert_pdf_to_markdown(str(pdf_file))
+            markdown_file = self.convert_pdf_to_markdown(str(pdf_file), force=force)
             if markdown_file:
                 markdown_files.append(markdown_file)
         
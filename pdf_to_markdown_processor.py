@@ -17,15 +17,10 @@ import requests
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 
+from pdf_processor_common import create_session, is_up_to_date, parse_json, setup_logging
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('pdf_processor.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -53,6 +48,9 @@ class PDFToMarkdownProcessor:
         self.data_folder.mkdir(exist_ok=True)
         self.api_base_url = api_base_url
         
+        # One pooled keep-alive session for every call to the API
+        self.session = create_session()
+        
         # Test API connection
         if not self._test_api_connection():
             raise ConnectionError(f"Cannot connect to API at {api_base_url}")
@@ -60,7 +58,7 @@ class PDFToMarkdownProcessor:
     def _test_api_connection(self) -> bool:
         """Test if the API is accessible"""
         try:
-            response = requests.get(f"{self.api_base_url}/docs", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/docs", timeout=5)
             if response.status_code == 200:
                 logger.info("API connection successful")
                 return True
@@ -74,7 +72,7 @@ class PDFToMarkdownProcessor:
     def _get_api_endpoints(self) -> Dict[str, str]:
         """Get available API endpoints"""
         try:
-            response = requests.get(f"{self.api_base_url}/openapi.json", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/openapi.json", timeout=5)
             if response.status_code == 200:
                 openapi_spec = response.json()
                 endpoints = {}
@@ -130,10 +128,10 @@ class PDFToMarkdownProcessor:
                 markdown_prompt = '<image>\n<|grounding|>Convert the document to markdown.'
                 data = {'prompt': markdown_prompt}
                 
-                response = requests.post(url, files=files, data=data, timeout=300)
+                response = self.session.post(url, files=files, data=data, timeout=300)
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    result = parse_json(response)
                     logger.info(f"Successfully processed PDF using endpoint: {endpoint}")
                     
                     # Extract markdown content from BatchOCRResponse
@@ -141,16 +139,15 @@ class PDFToMarkdownProcessor:
                         # Check if this is a batch response with results
                         if "results" in result and isinstance(result["results"], list):
                             # Combine all page results into a single markdown
-                            markdown_content = ""
-                            for page_result in result["results"]:
-                                if isinstance(page_result, dict) and "result" in page_result:
-                                    page_content = page_result["result"]
-                                    if page_content:
-                                        markdown_content += page_content + "\n\n<--- Page Split --->\n\n"
+                            markdown_content = "".join(
+                                page_result["result"] + "\n\n<--- Page Split --->\n\n"
+                                for page_result in result["results"]
+                                if isinstance(page_result, dict) and page_result.get("result")
+                            )
                             return markdown_content.strip()
                         
                         # Try common response field names
-                        for field in ["markdown", "content", "text", "result", "output"]:
+                        for field in ("markdown", "content", "text", "result", "output"):
                             if field in result:
                                 return result[field]
                         
@@ -166,17 +163,27 @@ class PDFToMarkdownProcessor:
             logger.error(f"Error processing {pdf_path}: {str(e)}")
             return None
     
-    def convert_pdf_to_markdown(self, pdf_path: str) -> Optional[str]:
+    def convert_pdf_to_markdown(self, pdf_path: str, force: bool = False) -> Optional[str]:
         """
         Convert a single PDF file to Markdown
         
         Args:
             pdf_path: Path to the PDF file
+            force: Convert again even if the output file is newer than the PDF
             
         Returns:
             Path to the generated Markdown file, or None if conversion failed
         """
         try:
+            # Output markdown file with -MD suffix
+            pdf_path_obj = Path(pdf_path)
+            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-MD.md")
+            
+            # Skip PDFs that have not changed since they were last converted
+            if not force and is_up_to_date(markdown_path, pdf_path_obj):
+                logger.info(f"Skipping {pdf_path}: {markdown_path} is up to date")
+                return str(markdown_path)
+            
             logger.info(f"Processing PDF: {pdf_path}")
             
             # Call OCR API
@@ -186,10 +193,6 @@ class PDFToMarkdownProcessor:
                 logger.error(f"Failed to get markdown content for {pdf_path}")
                 return None
             
-            # Save markdown file with -MD suffix
-            pdf_path_obj = Path(pdf_path)
-            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-MD.md")
-            
             with open(markdown_path, 'w', encoding='utf-8') as f:
                 f.write(markdown_content)
             
@@ -200,15 +203,21 @@ class PDFToMarkdownProcessor:
             logger.error(f"Error converting {pdf_path}: {str(e)}")
             return None
     
-    def scan_and_process_all_pdfs(self) -> List[str]:
+    def scan_and_process_all_pdfs(self, force: bool = False) -> List[str]:
         """
         Scan the data folder for PDF files and convert all of them to Markdown
         
+        Args:
+            force: Convert every PDF again, including ones whose output is up to date
+        
         Returns:
             List of paths to generated Markdown files
         """
-        # Find all PDF files in the data folder
-        pdf_files = list(self.data_folder.glob("*.pdf"))
+        # Find all PDF files in the data folder (any case of the .pdf extension),
+        # largest first so the slowest conversions don't end up in the tail
+        pdf_files = [path for path in self.data_folder.iterdir()
+                     if path.suffix.lower() == '.pdf' and path.is_file()]
+        pdf_files.sort(key=lambda path: path.stat().st_size, reverse=True)
         
         if not pdf_files:
             logger.info(f"No PDF files found in {self.data_folder}")
@@ -218,7 +227,7 @@ class PDFToMarkdownProcessor:
         
         markdown_files = []
         for pdf_file in pdf_files:
-            markdown_file = self.convert_pdf_to_markdown(str(pdf_file))
+            markdown_file = self.convert_pdf_to_markdown(str(pdf_file), force=force)
             if markdown_file:
                 markdown_files.append(markdown_file)
         
@@ -30,17 +30,16 @@ from PIL import Image, ImageDraw
 import numpy as np
 import fitz  # PyMuPDF
 
+from pdf_processor_common import create_session, is_up_to_date, parse_json, setup_logging
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('pdf_processor.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Patterns used on every page, compiled once
+_REF_RE = re.compile(r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)', re.DOTALL)
+_NEWLINES_RE = re.compile(r'\n{3,}')
+
 
 class Colors:
     """ANSI color codes for terminal output"""
@@ -68,6 +67,9 @@ class PDFToOCRProcessor:
         self.data_folder = Path(data_folder)
         self.data_folder.mkdir(exist_ok=True)
         self.api_base_url = api_base_url
+        
+        # One pooled keep-alive session for every call to the API
+        self.session = create_session()
         self.extract_images = extract_images
         self.create_images_folder = create_images_folder
         
@@ -78,6 +80,9 @@ class PDFToOCRProcessor:
         else:
             self.images_folder = None
         
+        # Rendered pages of the PDF currently being converted, keyed by (pdf_path, dpi)
+        self._page_images_cache: Dict[Tuple[str, int], List[Image.Image]] = {}
+        
         # Test API connection
         if not self._test_api_connection():
             raise ConnectionError(f"Cannot connect to API at {api_base_url}")
@@ -85,7 +90,7 @@ class PDFToOCRProcessor:
     def _test_api_connection(self) -> bool:
         """Test if the API is accessible"""
         try:
-            response = requests.get(f"{self.api_base_url}/docs", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/docs", timeout=5)
             if response.status_code == 200:
                 logger.info("API connection successful")
                 return True
@@ -99,7 +104,7 @@ class PDFToOCRProcessor:
     def _get_api_endpoints(self) -> Dict[str, str]:
         """Get available API endpoints"""
         try:
-            response = requests.get(f"{self.api_base_url}/openapi.json", timeout=5)
+            response = self.session.get(f"{self.api_base_url}/openapi.json", timeout=5)
             if response.status_code == 200:
                 openapi_spec = response.json()
                 endpoints = {}
@@ -135,13 +140,11 @@ class PDFToOCRProcessor:
             zoom = dpi / 72.0
             matrix = fitz.Matrix(zoom, zoom)
             
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
+            for page in pdf_document:
                 pixmap = page.get_pixmap(matrix=matrix, alpha=False)
                 
-                # Convert to PIL Image
-                img_data = pixmap.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
+                # Wrap the raw RGB samples directly (no PNG encode/decode round-trip)
+                img = Image.frombuffer("RGB", (pixmap.width, pixmap.height), pixmap.samples, "raw", "RGB", 0, 1)
                 images.append(img)
             
             pdf_document.close()
@@ -150,6 +153,24 @@ class PDFToOCRProcessor:
         
         return images
     
+    def _get_page_images(self, pdf_path: str, dpi: int = 144) -> List[Image.Image]:
+        """
+        Get the rendered pages of a PDF, rasterizing the document only once per conversion
+        
+        Args:
+            pdf_path: Path to the PDF file
+            dpi: Resolution for conversion
+            
+        Returns:
+            List of PIL Images
+        """
+        key = (pdf_path, dpi)
+        images = self._page_images_cache.get(key)
+        if images is None:
+            images = self._pdf_to_images(pdf_path, dpi)
+            self._page_images_cache[key] = images
+        return images
+    
     def _re_match(self, text: str) -> Tuple[List, List, List]:
         """
         Match reference patterns in the text
@@ -160,8 +181,7 @@ class PDFToOCRProcessor:
         Returns:
             Tuple of (all_matches, image_matches, other_matches)
         """
-        pattern = r'(<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>)'
-        matches = re.findall(pattern, text, re.DOTALL)
+        matches = _REF_RE.findall(text)
         
         matches_image = []
         matches_other = []
@@ -208,59 +228,54 @@ class PDFToOCRProcessor:
             return content, 0
         
         # Get PDF images for this page
-        pdf_images = self._pdf_to_images(pdf_path)
+        pdf_images = self._get_page_images(pdf_path)
         if page_idx >= len(pdf_images):
             return content, 0
         
         page_image = pdf_images[page_idx]
         image_width, image_height = page_image.size
         
-        # Find all image references
-        _, matches_images, _ = self._re_match(content)
         img_idx = 0
         
-        for idx, a_match_image in enumerate(matches_images):
+        def replace_image_ref(match):
+            nonlocal img_idx
+            # Leave non-image references for _clean_content
+            if match.group(2) != 'image':
+                return match.group(0)
+            
             try:
-                # Extract the reference text
-                pattern = r'<\|ref\|>image<\|/ref\|><\|det\|>(.*?)<\|/det\|>'
-                det_match = re.search(pattern, a_match_image)
+                coordinates = eval(match.group(3))
                 
-                if det_match:
-                    det_content = det_match.group(1)
-                    try:
-                        coordinates = eval(det_content)
-                        
-                        # Extract and save the image
-                        for points in coordinates:
-                            x1, y1, x2, y2 = points
-                            
-                            # Scale coordinates to actual image size
-                            x1 = int(x1 / 999 * image_width)
-                            y1 = int(y1 / 999 * image_height)
-                            x2 = int(x2 / 999 * image_width)
-                            y2 = int(y2 / 999 * image_height)
-                            
-                            # Crop and save the image
-                            cropped = page_image.crop((x1, y1, x2, y2))
-                            image_filename = f"{Path(pdf_path).stem}_page{page_idx}_{img_idx}.jpg"
-                            image_path = self.images_folder / image_filename
-                            cropped.save(image_path)
-                            
-                            # Replace reference with markdown link with URL-encoded filename
-                            # The images folder is relative to the markdown file location
-                            encoded_filename = urllib.parse.quote(image_filename)
-                            markdown_link = f"![](images/{encoded_filename})\n"
-                            content = content.replace(a_match_image, markdown_link, 1)
-                            
-                            img_idx += 1
-                            break
-                    except Exception as e:
-                        logger.error(f"Error processing image coordinates: {str(e)}")
-                        # If we can't process the coordinates, just remove the tag
-                        content = content.replace(a_match_image, "", 1)
+                # Extract and save the image
+                for points in coordinates:
+                    x1, y1, x2, y2 = points
+                    
+                    # Scale coordinates to actual image size
+                    x1 = int(x1 / 999 * image_width)
+                    y1 = int(y1 / 999 * image_height)
+                    x2 = int(x2 / 999 * image_width)
+                    y2 = int(y2 / 999 * image_height)
+                    
+                    # Crop and save the image
+                    cropped = page_image.crop((x1, y1, x2, y2))
+                    image_filename = f"{Path(pdf_path).stem}_page{page_idx}_{img_idx}.jpg"
+                    image_path = self.images_folder / image_filename
+                    cropped.save(image_path)
+                    img_idx += 1
+                    
+                    # Replace reference with markdown link with URL-encoded filename
+                    # The images folder is relative to the markdown file location
+                    encoded_filename = urllib.parse.quote(image_filename)
+                    return f"![](images/{encoded_filename})\n"
             except Exception as e:
-                logger.error(f"Error extracting image: {str(e)}")
-                content = content.replace(a_match_image, "", 1)
+                logger.error(f"Error processing image coordinates: {str(e)}")
+                # If we can't process the coordinates, just remove the tag
+                return ""
+            
+            return match.group(0)
+        
+        # Rewrite every image reference in a single pass, so duplicate tags each get their own index
+        content = _REF_RE.sub(replace_image_ref, content)
         
         return content, img_idx
     
@@ -278,20 +293,15 @@ class PDFToOCRProcessor:
         if '<｜end▁of▁sentence｜>' in content:
             content = content.replace('<｜end▁of▁sentence｜>', '')
         
-        # Get all non-image references
-        _, _, matches_other = self._re_match(content)
-        
-        # Remove other reference tags and clean up
-        for idx, a_match_other in enumerate(matches_other):
-            content = content.replace(a_match_other, '')
+        # Remove all non-image reference tags in a single pass
+        content = _REF_RE.sub(lambda m: m.group(0) if m.group(2) == 'image' else '', content)
         
         # Replace special LaTeX-like symbols
         content = content.replace('\\coloneqq', ':=')
         content = content.replace('\\eqqcolon', '=:')
         
         # Clean up excessive newlines
-        content = content.replace('\n\n\n\n', '\n\n')
-        content = content.replace('\n\n\n', '\n\n')
+        content = _NEWLINES_RE.sub('\n\n', content)
         
         return content.strip()
     
@@ -347,10 +357,10 @@ class PDFToOCRProcessor:
                 ocr_prompt = '<image>\nFree OCR.'
                 data = {'prompt': ocr_prompt}
                 
-                response = requests.post(url, files=files, data=data, timeout=300)
+                response = self.session.post(url, files=files, data=data, timeout=300)
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    result = parse_json(response)
                     logger.info(f"Successfully processed PDF using endpoint: {endpoint}")
                     
                     # Extract OCR content from BatchOCRResponse
@@ -358,21 +368,16 @@ class PDFToOCRProcessor:
                         # Check if this is a batch response with results
                         if "results" in result and isinstance(result["results"], list):
                             # Process each page with post-processing
-                            processed_content = ""
-                            for page_idx, page_result in enumerate(result["results"]):
-                                if isinstance(page_result, dict) and "result" in page_result:
-                                    page_content = page_result["result"]
-                                    if page_content:
-                                        # Apply post-processing to each page
-                                        processed_page = self._process_page_content(
-                                            pdf_path, page_content, page_idx
-                                        )
-                                        processed_content += processed_page
+                            processed_content = "".join(
+                                self._process_page_content(pdf_path, page_result["result"], page_idx)
+                                for page_idx, page_result in enumerate(result["results"])
+                                if isinstance(page_result, dict) and page_result.get("result")
+                            )
                             
                             return processed_content.strip()
                         
                         # Try common response field names
-                        for field in ["markdown", "content", "text", "result", "output"]:
+                        for field in ("markdown", "content", "text", "result", "output"):
                             if field in result:
                                 # Single page processing
                                 return self._process_page_content(pdf_path, result[field], 0)
@@ -389,17 +394,27 @@ class PDFToOCRProcessor:
             logger.error(f"Error processing {pdf_path}: {str(e)}")
             return None
     
-    def convert_pdf_to_ocr(self, pdf_path: str) -> Optional[str]:
+    def convert_pdf_to_ocr(self, pdf_path: str, force: bool = False) -> Optional[str]:
         """
         Convert a single PDF file to OCR text
         
         Args:
             pdf_path: Path to the PDF file
+            force: Convert again even if the output file is newer than the PDF
             
         Returns:
             Path to the generated Markdown file, or None if conversion failed
         """
         try:
+            # Output markdown file with -OCR suffix
+            pdf_path_obj = Path(pdf_path)
+            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-OCR.md")
+            
+            # Skip PDFs that have not changed since they were last converted
+            if not force and is_up_to_date(markdown_path, pdf_path_obj):
+                logger.info(f"Skipping {pdf_path}: {markdown_path} is up to date")
+                return str(markdown_path)
+            
             logger.info(f"Processing PDF: {pdf_path}")
             
             # Call OCR API
@@ -409,10 +424,6 @@ class PDFToOCRProcessor:
                 logger.error(f"Failed to get OCR content for {pdf_path}")
                 return None
             
-            # Save markdown file with -OCR suffix
-            pdf_path_obj = Path(pdf_path)
-            markdown_path = pdf_path_obj.with_name(f"{pdf_path_obj.stem}-OCR.md")
-            
             with open(markdown_path, 'w', encoding='utf-8') as f:
                 f.write(ocr_content)
             
@@ -422,16 +433,26 @@ class PDFToOCRProcessor:
         except Exception as e:
             logger.error(f"Error converting {pdf_path}: {str(e)}")
             return None
+        finally:
+            # Page renders are only needed while this PDF is being post-processed
+            for key in [key for key in list(self._page_images_cache) if key[0] == pdf_path]:
+                self._page_images_cache.pop(key, None)
     
-    def scan_and_process_all_pdfs(self) -> List[str]:
+    def scan_and_process_all_pdfs(self, force: bool = False) -> List[str]:
         """
         Scan the data folder for PDF files and convert all of them to OCR text
         
+        Args:
+            force: Convert every PDF again, including ones whose output is up to date
+        
         Returns:
             List of paths to generated Markdown files
         """
-        # Find all PDF files in the data folder
-        pdf_files = list(self.data_folder.glob("*.pdf"))
+        # Find all PDF files in the data folder (any case of the .pdf extension),
+        # largest first so the slowest conversions don't end up in the tail
+        pdf_files = [path for path in self.data_folder.iterdir()
+                     if path.suffix.lower() == '.pdf' and path.is_file()]
+        pdf_files.sort(key=lambda path: path.stat().st_size, reverse=True)
         
         if not pdf_files:
             logger.info(f"No PDF files found in {self.data_folder}")
@@ -441,7 +462,7 @@ class PDFToOCRProcessor:
         
         markdown_files = []
         for pdf_file in pdf_files:
-            markdown_file = self.convert_pdf_to_ocr(str(pdf_file))
+            markdown_file = self.convert_pdf_to_ocr(str(pdf_file), force=force)
             if markdown_file:
                 markdown_files.append(markdown_file)
         
@@ -6,132 +6,278 @@ import sys
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import fitz  # PyMuPDF
 import subprocess
 import io
+import re
 import contextlib
+import tempfile
+import shutil
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def check_dependency_versions():
+    """Verify transformers and tokenizers versions for DeepSeek-OCR compatibility"""
+    print("Checking transformers and tokenizers version compatibility...")
+    try:
+        import transformers
+        import tokenizers
+
+        transformers_version = transformers.__version__
+        tokenizers_version = tokenizers.__version__
+
+        print(f"Current transformers version: {transformers_version}")
+        print(f"Current tokenizers version: {tokenizers_version}")
+
+        # DeepSeek-OCR requires specific versions to read tokenizer files correctly
+        REQUIRED_TRANSFORMERS = "4.46.3"
+        REQUIRED_TOKENIZERS = "0.20.3"
+
+        needs_update = False
+
+        if transformers_version != REQUIRED_TRANSFORMERS:
+            print(f"Warning: transformers {transformers_version} detected, but DeepSeek-OCR requires {REQUIRED_TRANSFORMERS}")
+            needs_update = True
+
+        if tokenizers_version != REQUIRED_TOKENIZERS:
+            print(f"Warning: tokenizers {tokenizers_version} detected, but DeepSeek-OCR requires {REQUIRED_TOKENIZERS}")
+            needs_update = True
+
+        if needs_update:
+            print(f"Installing required versions: transformers=={REQUIRED_TRANSFORMERS}, tokenizers=={REQUIRED_TOKENIZERS}")
+            subprocess.check_call([
+                sys.executable, "-m", "pip", "install", "--no-cache-dir",
+                f"transformers=={REQUIRED_TRANSFORMERS}",
+                f"tokenizers=={REQUIRED_TOKENIZERS}"
+            ])
+            print("Dependencies updated successfully. Reloading...")
+            import importlib
+            importlib.reload(transformers)
+            importlib.reload(tokenizers)
+        else:
+            print("✓ All versions compatible with DeepSeek-OCR")
 
-# Verify transformers and tokenizers versions for DeepSeek-OCR compatibility
-print("Checking transformers and tokenizers version compatibility...")
-try:
-    import transformers
-    import tokenizers
-
-    transformers_version = transformers.__version__
-    tokenizers_version = tokenizers.__version__
-
-    print(f"Current transformers version: {transformers_version}")
-    print(f"Current tokenizers version: {tokenizers_version}")
-
-    # DeepSeek-OCR requires specific versions to read tokenizer files correctly
-    REQUIRED_TRANSFORMERS = "4.46.3"
-    REQUIRED_TOKENIZERS = "0.20.3"
-
-    needs_update = False
-
-    if transformers_version != REQUIRED_TRANSFORMERS:
-        print(f"Warning: transformers {transformers_version} detected, but DeepSeek-OCR requires {REQUIRED_TRANSFORMERS}")
-        needs_update = True
-
-    if tokenizers_version != REQUIRED_TOKENIZERS:
-        print(f"Warning: tokenizers {tokenizers_version} detected, but DeepSeek-OCR requires {REQUIRED_TOKENIZERS}")
-        needs_update = True
-
-    if needs_update:
-        print(f"Installing required versions: transformers=={REQUIRED_TRANSFORMERS}, tokenizers=={REQUIRED_TOKENIZERS}")
-        subprocess.check_call([
-            sys.executable, "-m", "pip", "install", "--no-cache-dir",
-            f"transformers=={REQUIRED_TRANSFORMERS}",
-            f"tokenizers=={REQUIRED_TOKENIZERS}"
-        ])
-        print("Dependencies updated successfully. Reloading...")
-        import importlib
-        importlib.reload(transformers)
-        importlib.reload(tokenizers)
-    else:
-        print("✓ All versions compatible with DeepSeek-OCR")
-
-except Exception as e:
-    print(f"Warning during version check: {e}")
+    except Exception as e:
+        print(f"Warning during version check: {e}")
 
 # Add DeepSeek-OCR to path
 sys.path.insert(0, '/app/DeepSeek-OCR')
 
-from transformers import AutoModel, AutoTokenizer
 import torch
 
-# Initialize model at startup
+# This worker only runs inference: skip autograd bookkeeping everywhere
+torch.set_grad_enabled(False)
+
 MODEL_PATH = os.environ.get("MODEL_PATH", "/app/models/DeepSeek-OCR")
-print(f"Loading model from: {MODEL_PATH}")
-
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
-
-# Try to use flash_attention_2 for optimal performance
-try:
-    print("Attempting to load model with flash_attention_2...")
-    model = AutoModel.from_pretrained(
-        MODEL_PATH,
-        _attn_implementation='flash_attention_2',
-        trust_remote_code=True,
-        use_safetensors=True,
-        torch_dtype=torch.bfloat16
-    ).cuda().eval()
-    print("Model loaded successfully with flash_attention_2!")
-except Exception as e:
-    print(f"Failed to load with flash_attention_2: {e}")
-    print("Falling back to standard attention implementation...")
-    model = AutoModel.from_pretrained(
-        MODEL_PATH,
-        trust_remote_code=True,
-        use_safetensors=True,
-        torch_dtype=torch.bfloat16
-    ).cuda().eval()
-    print("Model loaded successfully with standard attention!")
+
+# Optionally compile the vision encoders, whose inputs are fixed-size 1024/640
+# views. The decoder is left eager: generate() grows its KV cache every step,
+# which would keep recompiling. Graphs that fail to compile fall back to eager.
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+
+# Loaded by load_model() when the worker starts
+tokenizer = None
+model = None
+
+def load_model():
+    """Load the tokenizer and model onto the GPU"""
+    # Imported here so check_dependency_versions() can update transformers first
+    from transformers import AutoModel, AutoTokenizer
+
+    print(f"Loading model from: {MODEL_PATH}")
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
+
+    # Try to use flash_attention_2 for optimal performance
+    try:
+        print("Attempting to load model with flash_attention_2...")
+        model = AutoModel.from_pretrained(
+            MODEL_PATH,
+            _attn_implementation='flash_attention_2',
+            trust_remote_code=True,
+            use_safetensors=True,
+            torch_dtype=torch.bfloat16
+        ).cuda().eval()
+        print("Model loaded successfully with flash_attention_2!")
+    except Exception as e:
+        print(f"Failed to load with flash_attention_2: {e}")
+        print("Falling back to standard attention implementation...")
+        model = AutoModel.from_pretrained(
+            MODEL_PATH,
+            trust_remote_code=True,
+            use_safetensors=True,
+            torch_dtype=torch.bfloat16
+        ).cuda().eval()
+        print("Model loaded successfully with standard attention!")
+
+    if TORCH_COMPILE:
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        torch.set_float32_matmul_precision('high')
+        inner_model = getattr(model, "model", model)
+        for name in ("sam_model", "vision_model"):
+            module = getattr(inner_model, name, None)
+            if module is not None:
+                setattr(inner_model, name, torch.compile(module))
+                print(f"Compiled {name} with torch.compile")
+
+    return tokenizer, model
 
 # Chunk storage directory (use network volume if available, otherwise /tmp)
 CHUNK_STORAGE_DIR = os.environ.get("RUNPOD_VOLUME_PATH", "/tmp") + "/pdf_chunks"
 os.makedirs(CHUNK_STORAGE_DIR, exist_ok=True)
 
+# Base64 characters decoded per write when saving an uploaded chunk (a multiple of 4)
+BASE64_DECODE_STEP = 4 * 256 * 1024
+# Buffer size used when concatenating saved chunks into the assembled PDF
+CHUNK_COPY_BUFFER = 1024 * 1024
+
+# RAM-backed scratch space for the page images model.infer() reads back from disk.
+# Whole PDFs go to the regular temp directory instead: they can be far larger
+# than the container's /dev/shm
+IMAGE_SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Debug/log lines DeepSeek-OCR prints alongside the OCR text, matched in one pass
+SKIP_LINE_RE = re.compile('|'.join(map(re.escape, [
+    '=====', 'PATCHES:', 'BASE:', 'Setting `pad_token_id`', 'The attention mask', 'Processing page'
+])))
+
+# CPU processes that rasterize upcoming PDF pages while the GPU runs inference
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Shared rasterization pool, started before the model is loaded
+render_pool = None
+
+# Longest page side (pixels) worth rendering: infer() tiles pages into a grid of
+# 640px crops (1280x1920 for A4/Letter), so oversized pages are rendered smaller
+# instead of being rasterized at full DPI and downscaled by the model
+MAX_RENDER_SIDE = int(os.environ.get("MAX_RENDER_SIDE", 2048))
+
+# Pooled keep-alive session for PDF downloads; large files are fetched as
+# DOWNLOAD_CONNECTIONS parallel byte ranges when the server supports it
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 8))
+PARALLEL_DOWNLOAD_MIN_BYTES = 32 * 1024 * 1024
+
+http_session = requests.Session()
+http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DOWNLOAD_CONNECTIONS)
+http_session.mount("http://", http_adapter)
+http_session.mount("https://", http_adapter)
+
+def _download_range(url, buffer, start, end, timeout):
+    """Download bytes start..end (inclusive) of url into the same offsets of buffer"""
+    response = http_session.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=timeout, stream=True)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise Exception(f"Server ignored range request (status {response.status_code})")
+
+    view = memoryview(buffer)
+    offset = start
+    for block in response.iter_content(chunk_size=1 << 20):
+        view[offset:offset + len(block)] = block
+        offset += len(block)
+    view.release()
+
+    if offset != end + 1:
+        raise Exception(f"Incomplete range {start}-{end}: got {offset - start} bytes")
+
 def download_from_url(url, timeout=300):
     """Download file from URL"""
     try:
-        response = requests.get(url, timeout=timeout, stream=True)
+        # The HEAD only decides whether a ranged download is possible; servers
+        # that reject or drop it still get the plain GET below
+        try:
+            head = http_session.head(url, timeout=timeout, allow_redirects=True)
+            size = int(head.headers.get("Content-Length", 0))
+        except Exception as e:
+            print(f"HEAD request failed, downloading in one request: {e}")
+            head = None
+
+        if (head is not None and head.ok and head.headers.get("Accept-Ranges") == "bytes"
+                and size >= PARALLEL_DOWNLOAD_MIN_BYTES and DOWNLOAD_CONNECTIONS > 1):
+            buffer = bytearray(size)
+            part_size = -(-size // DOWNLOAD_CONNECTIONS)
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_CONNECTIONS) as executor:
+                parts = [executor.submit(_download_range, head.url, buffer, start,
+                                         min(start + part_size, size) - 1, timeout)
+                         for start in range(0, size, part_size)]
+                for part in parts:
+                    part.result()
+            return buffer
+
+        response = http_session.get(url, timeout=timeout)
         response.raise_for_status()
         return response.content
     except Exception as e:
         raise Exception(f"Failed to download from URL: {str(e)}")
 
-def pdf_to_images(pdf_data, dpi=144):
-    """Convert PDF bytes to list of PIL Images"""
-    images = []
-    pdf_document = fitz.open(stream=pdf_data, filetype="pdf")
-
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-
-        # Render page to pixmap
-        mat = fitz.Matrix(dpi/72, dpi/72)
-        pix = page.get_pixmap(matrix=mat)
-
-        # Convert to PIL Image
-        img_data = pix.tobytes("ppm")
-        image = Image.open(BytesIO(img_data)).convert("RGB")
-        images.append(image)
-
-    pdf_document.close()
-    return images
-
-def process_image_with_model(image, prompt, page_num=None):
+def page_matrix(page, dpi):
+    """Render matrix for a page at `dpi`, reduced so its longest side stays within MAX_RENDER_SIDE"""
+    zoom = min(dpi/72, MAX_RENDER_SIDE / max(page.rect.width, page.rect.height))
+    return fitz.Matrix(zoom, zoom)
+
+# PDF handle kept open in each rasterization worker for the rest of its pages
+_render_document = None
+
+def _render_page(pdf_path, page_idx, dpi):
+    """Render a single page; returns raw RGB bytes so no PIL object has to be pickled"""
+    global _render_document
+    if _render_document is None or _render_document.name != pdf_path:
+        if _render_document is not None:
+            _render_document.close()
+        _render_document = fitz.open(pdf_path)
+
+    page = _render_document[page_idx]
+    pix = page.get_pixmap(matrix=page_matrix(page, dpi), alpha=False)
+    return page_idx, pix.width, pix.height, pix.samples
+
+def iter_pdf_images(pdf_path, page_count, dpi=144):
+    """Render PDF pages one at a time, yielding PIL Images so only a few pages are kept in memory"""
+    workers = min(RENDER_WORKERS, page_count)
+
+    if render_pool is None or workers <= 1:
+        with fitz.open(pdf_path) as pdf_document:
+            for page in pdf_document:
+                # Render page to pixmap (no alpha channel, the model only takes RGB)
+                pix = page.get_pixmap(matrix=page_matrix(page, dpi), alpha=False)
+
+                # Wrap the raw RGB samples directly (no PPM encode/decode round-trip)
+                yield Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", 0, 1)
+        return
+
+    # Keep a bounded window of pages rendering ahead of the model so the GPU
+    # never waits on MuPDF, without rasterizing the whole document up front
+    prefetch = workers + 2
+    pending = deque()
+    next_page = 0
+    try:
+        while next_page < page_count or pending:
+            while next_page < page_count and len(pending) < prefetch:
+                pending.append(render_pool.submit(_render_page, pdf_path, next_page, dpi))
+                next_page += 1
+
+            _, width, height, samples = pending.popleft().result()
+            yield Image.frombuffer("RGB", (width, height), samples, "raw", "RGB", 0, 1)
+    finally:
+        # The pool outlives this document: drop pages queued for a failed job
+        for future in pending:
+            future.cancel()
+
+def process_image_with_model(image, prompt, raise_on_error=False):
     """Process a single image with the model and capture stdout"""
-    # Save image temporarily
-    temp_path = f"/tmp/temp_image_{page_num or 0}.jpg"
-    image.save(temp_path)
+    # Save image temporarily; a unique name keeps concurrent requests apart, and
+    # fast lossless PNG avoids a JPEG encode that also degrades the page
+    with tempfile.NamedTemporaryFile(suffix=".png", dir=IMAGE_SCRATCH_DIR, delete=False) as temp_file:
+        image.save(temp_file, format="PNG", compress_level=1)
+        temp_path = temp_file.name
     
     # Capture stdout - DeepSeek-OCR prints results instead of returning them
     captured_output = io.StringIO()
+    error = None
     
     try:
-        with contextlib.redirect_stdout(captured_output):
+        with contextlib.redirect_stdout(captured_output), torch.inference_mode():
             result = model.infer(
                 tokenizer,
                 prompt=prompt,
@@ -144,6 +290,7 @@ def process_image_with_model(image, prompt, page_num=None):
     except Exception as e:
         print(f"Error during inference: {e}")
         result = None
+        error = e
     
     # Get the captured text from stdout
     ocr_text = captured_output.getvalue()
@@ -153,25 +300,15 @@ def process_image_with_model(image, prompt, page_num=None):
         os.remove(temp_path)
     except:
         pass
+
+    if error is not None and raise_on_error:
+        raise error
     
     # Clean up the OCR text by removing debug lines
     if ocr_text:
         lines = ocr_text.split('\n')
-        # Filter out debug/log lines, keep only the actual OCR content
-        cleaned_lines = []
-        skip_markers = ['=====', 'PATCHES:', 'BASE:', 'Setting `pad_token_id`', 
-                       'The attention mask', 'Processing page']
-        
-        for line in lines:
-            # Skip empty lines and debug markers
-            should_skip = False
-            for marker in skip_markers:
-                if marker in line:
-                    should_skip = True
-                    break
-            
-            if not should_skip and line.strip():
-                cleaned_lines.append(line)
+        # Filter out empty and debug/log lines, keep only the actual OCR content
+        cleaned_lines = [line for line in lines if line.strip() and not SKIP_LINE_RE.search(line)]
         
         ocr_text = '\n'.join(cleaned_lines).strip()
     
@@ -197,15 +334,15 @@ def handler(event):
             pdf_url = input_data["pdf_url"]
             filename = pdf_url.split('/')[-1].replace('.pdf', '')
             print(f"Downloading PDF from URL: {pdf_url}")
-            pdf_data = download_from_url(pdf_url)
-            return process_pdf(pdf_data, prompt, filename)
+            # The downloaded bytes go straight to disk and are dropped before OCR starts
+            return process_scratch_pdf(save_scratch_pdf(download_from_url(pdf_url)), prompt, filename)
 
         # Method 3: Handle PDF from base64
         elif "pdf_base64" in input_data:
             print("Processing PDF from base64")
             filename = input_data.get("filename", "document")
-            pdf_data = base64.b64decode(input_data["pdf_base64"])
-            return process_pdf(pdf_data, prompt, filename)
+            return process_scratch_pdf(save_scratch_pdf(base64.b64decode(input_data["pdf_base64"])),
+                                       prompt, filename)
 
         # Method 4: Handle single image (backward compatible)
         elif "image_base64" in input_data:
@@ -230,62 +367,71 @@ def handler(event):
             "traceback": traceback.format_exc()
         }
 
-def process_pdf(pdf_data, prompt, filename="document"):
-    """Process a complete PDF and return markdown file"""
-    print(f"Converting PDF to images (size: {len(pdf_data)} bytes)")
-    images = pdf_to_images(pdf_data)
-    print(f"Processing {len(images)} pages")
+def create_scratch_pdf():
+    """Create an empty temporary PDF file and return it open for writing"""
+    return tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+
+def save_scratch_pdf(pdf_data):
+    """Write PDF bytes to a temporary file and return its path"""
+    # MuPDF and the render workers open the PDF from a file, so the document is
+    # read on demand instead of being copied into every process
+    with create_scratch_pdf() as pdf_file:
+        pdf_file.write(pdf_data)
+    return pdf_file.name
+
+def process_scratch_pdf(pdf_path, prompt, filename="document"):
+    """Process a temporary PDF file and remove it afterwards"""
+    try:
+        return process_pdf_file(pdf_path, prompt, filename)
+    finally:
+        os.remove(pdf_path)
+
+def process_pdf_file(pdf_path, prompt, filename="document"):
+    """Process a PDF file on disk and return markdown file"""
+    print(f"Opening PDF (size: {os.path.getsize(pdf_path)} bytes)")
+    with fitz.open(pdf_path) as pdf_document:
+        total_pages = pdf_document.page_count
+    print(f"Processing {total_pages} pages")
 
-    results = []
-    markdown_pages = []
+    results = [None] * total_pages
+
+    # Pages are appended as UTF-8 to one buffer as they finish
+    md_filename = f"{filename}-MD.md"
+    md_buffer = io.BytesIO()
     
-    for i, image in enumerate(images):
-        print(f"Processing page {i+1}/{len(images)}")
-        page_result = process_image_with_model(image, prompt, page_num=i+1)
+    # Pages are rendered lazily and a few pages ahead, so memory stays flat
+    # while rasterization overlaps with inference
+    for i, image in enumerate(iter_pdf_images(pdf_path, total_pages)):
+        print(f"Processing page {i+1}/{total_pages}")
+        page_result = process_image_with_model(image, prompt)
         
-        results.append({
+        results[i] = {
             "page": i + 1,
             "result": page_result
-        })
+        }
         
         if page_result:
             # Add page separator
             if i > 0:
-                markdown_pages.append("\n\n---\n\n")
-            markdown_pages.append(f"# Page {i + 1}\n\n")
-            markdown_pages.append(page_result)
-    
-    # Combine all pages into a single markdown document
-    full_markdown = "".join(markdown_pages)
-    
-    # Save markdown to file
-    md_filename = f"{filename}-MD.md"
-    md_filepath = f"/tmp/{md_filename}"
+                md_buffer.write(b"\n\n---\n\n")
+            md_buffer.write(f"# Page {i + 1}\n\n".encode('utf-8'))
+            md_buffer.write(page_result.encode('utf-8'))
     
-    with open(md_filepath, 'w', encoding='utf-8') as f:
-        f.write(full_markdown)
-    
-    print(f"Saved markdown to {md_filepath}")
-    
-    # Encode file as base64 for download
-    with open(md_filepath, 'rb') as f:
-        md_file_base64 = base64.b64encode(f.read()).decode('utf-8')
-    
-    # Clean up temp file
-    try:
-        os.remove(md_filepath)
-    except:
-        pass
+    # The same bytes give the text, the download copy and its size
+    md_bytes = md_buffer.getvalue()
+    md_buffer.close()
+    full_markdown = md_bytes.decode('utf-8')
+    md_file_base64 = base64.b64encode(md_bytes).decode('ascii')
 
     return {
         "success": True,
-        "total_pages": len(images),
+        "total_pages": total_pages,
         "results": results,
         "markdown": full_markdown,  # Full text content
         "markdown_file": {
             "filename": md_filename,
             "content_base64": md_file_base64,  # Base64-encoded file for download
-            "size_bytes": len(full_markdown.encode('utf-8'))
+            "size_bytes": len(md_bytes)
         }
     }
 
@@ -313,17 +459,23 @@ def handle_chunked_upload(input_data, prompt):
         with open(metadata_file, 'w') as f:
             json.dump({"total_chunks": total_chunks, "filename": filename}, f)
 
-    # Save this chunk to disk
+    # Save this chunk to disk, decoding the base64 in slices so the whole decoded
+    # chunk is never held in memory. It is written under a temporary name and
+    # renamed into place, so the chunk counter below never sees a partial file.
     chunk_file = os.path.join(upload_dir, f"chunk_{chunk_index:04d}.bin")
-    chunk_bytes = base64.b64decode(chunk_data)
-    with open(chunk_file, 'wb') as f:
-        f.write(chunk_bytes)
+    partial_file = os.path.join(upload_dir, f".chunk_{chunk_index:04d}.part")
+    chunk_size = 0
+    with open(partial_file, 'wb') as f:
+        for start in range(0, len(chunk_data), BASE64_DECODE_STEP):
+            chunk_size += f.write(base64.b64decode(chunk_data[start:start + BASE64_DECODE_STEP]))
+    os.replace(partial_file, chunk_file)
 
-    print(f"Saved chunk {chunk_index + 1}/{total_chunks} for upload {chunk_id} ({len(chunk_bytes)} bytes)")
+    print(f"Saved chunk {chunk_index + 1}/{total_chunks} for upload {chunk_id} ({chunk_size} bytes)")
 
-    # Check how many chunks we have
-    existing_chunks = [f for f in os.listdir(upload_dir) if f.startswith("chunk_")]
-    received_chunks = len(existing_chunks)
+    # Check how many chunks we have (counting files rather than keeping a counter
+    # keeps retried chunks idempotent across workers sharing the volume)
+    with os.scandir(upload_dir) as entries:
+        received_chunks = sum(1 for entry in entries if entry.name.startswith("chunk_"))
 
     print(f"Progress: {received_chunks}/{total_chunks} chunks received")
 
@@ -336,26 +488,28 @@ def handle_chunked_upload(input_data, prompt):
             metadata = json.load(f)
             filename = metadata.get("filename", "document")
 
-        # Assemble PDF from chunks
-        pdf_data = b""
-        for i in range(total_chunks):
-            chunk_file = os.path.join(upload_dir, f"chunk_{i:04d}.bin")
+        # Assemble PDF from chunks by appending them to a single scratch file,
+        # which is handed to MuPDF directly without loading it into memory
+        chunk_files = [os.path.join(upload_dir, f"chunk_{i:04d}.bin") for i in range(total_chunks)]
+        for i, chunk_file in enumerate(chunk_files):
             if not os.path.exists(chunk_file):
                 return {"error": f"Missing chunk {i}"}
-            with open(chunk_file, 'rb') as f:
-                pdf_data += f.read()
+
+        with create_scratch_pdf() as pdf_file:
+            for chunk_file in chunk_files:
+                with open(chunk_file, 'rb') as f:
+                    shutil.copyfileobj(f, pdf_file, CHUNK_COPY_BUFFER)
 
         # Clean up chunk files
         try:
-            import shutil
             shutil.rmtree(upload_dir)
             print(f"Cleaned up temporary files for {chunk_id}")
         except Exception as e:
             print(f"Warning: Failed to clean up chunks: {e}")
 
         # Process the complete PDF
-        print(f"Assembled PDF: {len(pdf_data)} bytes, processing...")
-        return process_pdf(pdf_data, prompt, filename)
+        print(f"Assembled PDF: {os.path.getsize(pdf_file.name)} bytes, processing...")
+        return process_scratch_pdf(pdf_file.name, prompt, filename)
     else:
         # Return status - more chunks needed
         return {
@@ -366,4 +520,32 @@ def handle_chunked_upload(input_data, prompt):
             "message": f"Received {received_chunks}/{total_chunks} chunks"
         }
 
-runpod.serverless.start({"handler": handler})
+if __name__ == "__main__":
+    check_dependency_versions()
+
+    # One rasterization pool for the worker's lifetime, created before the model.
+    # Its processes are spawned from a fresh interpreter rather than forked, as
+    # forking a process that holds CUDA state or torch.compile threads can
+    # deadlock. They import this file as a module, which is why the model is
+    # only loaded under this __main__ guard.
+    if RENDER_WORKERS > 1:
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                          mp_context=multiprocessing.get_context("spawn"))
+
+    tokenizer, model = load_model()
+
+    # Run one page through the model before taking requests, so kernel selection,
+    # cuBLAS/cuDNN autotuning and any torch.compile work happen at startup instead
+    # of on the first job. A letter page at the default 144 DPI goes through both
+    # the global view and the cropped local views. A worker whose model cannot run
+    # inference exits here instead of registering as healthy.
+    print("Warming up model...")
+    try:
+        process_image_with_model(Image.new("RGB", (1224, 1584), "white"), "<image>\nFree OCR.",
+                                 raise_on_error=True)
+    except Exception as e:
+        print(f"Model warmup failed, refusing to start the worker: {e}")
+        sys.exit(1)
+    print("Model warmup complete")
+
+    runpod.serverless.start({"handler": handler})
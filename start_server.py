@@ -9,6 +9,9 @@ import sys
 import asyncio
 import io
 import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Optional
 from pathlib import Path
 
@@ -21,7 +24,6 @@ from pydantic import BaseModel
 import torch
 import fitz  # PyMuPDF
 from PIL import Image
-from tqdm import tqdm
 
 # Add current directory to Python path
 sys.path.insert(0, '/app/DeepSeek-OCR-vllm')
@@ -30,11 +32,14 @@ sys.path.insert(0, '/app/DeepSeek-OCR-vllm')
 if torch.version.cuda == '11.8':
     os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
 os.environ['VLLM_USE_V1'] = '0'
-os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", '0')
 
 # Import DeepSeek-OCR components
-from config import INPUT_PATH, OUTPUT_PATH, PROMPT, CROP_MODE, MAX_CONCURRENCY, NUM_WORKERS
+from config import (INPUT_PATH, OUTPUT_PATH, PROMPT, CROP_MODE, MAX_CONCURRENCY, NUM_WORKERS,
+                    MAX_NUM_BATCHED_TOKENS, BLOCK_SIZE, TENSOR_PARALLEL_SIZE, ENFORCE_EAGER,
+                    QUANTIZATION, KV_CACHE_DTYPE, resolve_quantization)
 MODEL_PATH = os.environ.get('MODEL_PATH', 'deepseek-ai/DeepSeek-OCR')
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', min(4, os.cpu_count() or 1)))
 from deepseek_ocr import DeepseekOCRForCausalLM
 from process.image_process import DeepseekOCRProcessor
 from vllm import LLM, SamplingParams
@@ -62,6 +67,10 @@ app.add_middleware(
 # Global variables for the model
 llm = None
 sampling_params = None
+processor = None
+
+# Process pool that rasterizes PDF pages, shared by all requests
+render_pool = None
 
 class OCRResponse(BaseModel):
     success: bool
@@ -77,7 +86,7 @@ class BatchOCRResponse(BaseModel):
 
 def initialize_model():
     """Initialize the vLLM model"""
-    global llm, sampling_params
+    global llm, sampling_params, processor
     
     if llm is None:
         print("Initializing DeepSeek-OCR model...")
@@ -86,20 +95,23 @@ def initialize_model():
         llm = LLM(
             model=MODEL_PATH,
             hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
-            block_size=256,
-            enforce_eager=False,
+            block_size=BLOCK_SIZE,
+            enforce_eager=ENFORCE_EAGER,
             trust_remote_code=True,
             max_model_len=8192,
             swap_space=0,
             max_num_seqs=MAX_CONCURRENCY,
-            tensor_parallel_size=1,
+            max_num_batched_tokens=MAX_NUM_BATCHED_TOKENS,
+            tensor_parallel_size=TENSOR_PARALLEL_SIZE or torch.cuda.device_count(),
+            quantization=resolve_quantization(QUANTIZATION),
+            kv_cache_dtype=KV_CACHE_DTYPE,
             gpu_memory_utilization=0.9,
             disable_mm_preprocessor_cache=True
         )
         
         # Set up sampling parameters
         from process.ngram_norepeat import NoRepeatNGramLogitsProcessor
-        logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=20, window_size=50, whitelist_token_ids={128821, 128822})]
+        logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=20, window_size=50, whitelist_token_ids={128821, 128822}, min_length=200)]
         
         sampling_params = SamplingParams(
             temperature=0.0,
@@ -109,49 +121,116 @@ def initialize_model():
             include_stop_str_in_output=True,
         )
         
+        # Build the image processor once; the server reuses it for every request
+        processor = DeepseekOCRProcessor()
+        
+        # Pay first-request costs (CUDA graph replay setup, kernel warm-up, lazy
+        # multimodal init) now rather than on the first user's page
+        print("Warming up model...")
+        warmup_image = Image.new("RGB", (640, 640), (255, 255, 255))
+        llm.generate([build_request(warmup_image, PROMPT)],
+                     sampling_params=SamplingParams(temperature=0.0, max_tokens=1))
+        
         print("Model initialization complete!")
 
-def pdf_to_images_high_quality(pdf_data: bytes, dpi: int = 144) -> List[Image.Image]:
-    """Convert PDF bytes to high-quality PIL Images"""
-    images = []
+def start_render_pool():
+    """Start the shared rasterization pool"""
+    global render_pool
+    
+    if render_pool is None and RENDER_WORKERS > 1:
+        # Spawned rather than forked: forking a process that holds CUDA state and
+        # vLLM threads can deadlock. Spawned workers import this file as a module,
+        # which only defines the app; the model is loaded at startup.
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                          mp_context=multiprocessing.get_context("spawn"))
+
+# PDF handle kept open in each rasterization worker for the rest of its pages
+_render_document = None
+
+def _render_page(pdf_path: str, page_idx: int, zoom: float):
+    """Render a single page; returns raw RGB bytes so no PIL object has to be pickled"""
+    global _render_document
+    if _render_document is None or _render_document.name != pdf_path:
+        if _render_document is not None:
+            _render_document.close()
+        _render_document = fitz.open(pdf_path)
     
+    pixmap = _render_document[page_idx].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return page_idx, pixmap.width, pixmap.height, pixmap.samples
+
+def iter_pdf_images(pdf_data: bytes, dpi: int = 144):
+    """
+    Yield (page_idx, PIL Image) pairs in page order.
+
+    Pages render in worker processes at most two pages per worker ahead of the
+    consumer, so they keep rasterizing while the caller runs inference without
+    the whole document piling up in memory. A page that fails to render is yielded with the
+    exception in place of its image.
+    """
     # Save PDF data to temporary file
     with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
         temp_pdf.write(pdf_data)
         temp_pdf_path = temp_pdf.name
     
     try:
-        pdf_document = fitz.open(temp_pdf_path)
         zoom = dpi / 72.0
-        matrix = fitz.Matrix(zoom, zoom)
-        
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            pixmap = page.get_pixmap(matrix=matrix, alpha=False)
-            
-            # Convert to PIL Image
-            img_data = pixmap.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            images.append(img)
+        with fitz.open(temp_pdf_path) as pdf_document:
+            page_count = pdf_document.page_count
+        workers = max(1, min(RENDER_WORKERS, page_count))
         
-        pdf_document.close()
+        if render_pool is not None and page_count > 1:
+            # MuPDF rasterization is CPU-bound, so spread pages over worker processes
+            pending = deque()
+            next_page = 0
+            try:
+                while next_page < page_count or pending:
+                    while next_page < page_count and len(pending) < 2 * workers:
+                        pending.append((next_page, render_pool.submit(_render_page, temp_pdf_path,
+                                                                      next_page, zoom)))
+                        next_page += 1
+                    
+                    page_idx, future = pending.popleft()
+                    try:
+                        _, width, height, samples = future.result()
+                    except Exception as e:
+                        yield page_idx, e
+                        continue
+                    # Wrap the raw RGB samples directly (no PNG encode/decode round-trip)
+                    yield page_idx, Image.frombuffer("RGB", (width, height), samples, "raw", "RGB", 0, 1)
+            finally:
+                # The pool is shared: drop pages still queued for an abandoned document
+                for _, future in pending:
+                    future.cancel()
+        else:
+            matrix = fitz.Matrix(zoom, zoom)
+            with fitz.open(temp_pdf_path) as pdf_document:
+                for page_idx, page in enumerate(pdf_document):
+                    try:
+                        pixmap = page.get_pixmap(matrix=matrix, alpha=False)
+                    except Exception as e:
+                        yield page_idx, e
+                        continue
+                    yield page_idx, Image.frombuffer("RGB", (pixmap.width, pixmap.height), pixmap.samples,
+                                                     "raw", "RGB", 0, 1)
     finally:
         # Clean up temporary file
         os.unlink(temp_pdf_path)
-    
+
+def pdf_to_images_high_quality(pdf_data: bytes, dpi: int = 144) -> List[Image.Image]:
+    """Convert PDF bytes to high-quality PIL Images"""
+    images = []
+    for _, image in iter_pdf_images(pdf_data, dpi):
+        if isinstance(image, Exception):
+            raise image
+        images.append(image)
     return images
 
-def process_single_image(image: Image.Image, prompt: str = PROMPT) -> str:
-    """Process a single image with DeepSeek-OCR using the specified prompt"""
-    print(f"[DEBUG] process_single_image called with prompt: {repr(prompt)}")
-    print(f"[DEBUG] Prompt length: {len(prompt)} characters")
-    print(f"[DEBUG] Prompt starts with <image>: {prompt.startswith('<image>')}")
-    
-    # Create request format for vLLM
-    request_item = {
+def build_request(image: Image.Image, prompt: str = PROMPT) -> dict:
+    """Build a vLLM request item for a single image"""
+    return {
         "prompt": prompt,
         "multi_modal_data": {
-            "image": DeepseekOCRProcessor().tokenize_with_images(
+            "image": processor.tokenize_with_images(
                 prompt=prompt,
                 images=[image],
                 bos=True,
@@ -160,6 +239,21 @@ def process_single_image(image: Image.Image, prompt: str = PROMPT) -> str:
             )
         }
     }
+
+def clean_result(result: str) -> str:
+    """Strip the end-of-sentence token from model output"""
+    if '<｜end▁of▁sentence｜>' in result:
+        result = result.replace('<｜end▁of▁sentence｜>', '')
+    return result
+
+def process_single_image(image: Image.Image, prompt: str = PROMPT) -> str:
+    """Process a single image with DeepSeek-OCR using the specified prompt"""
+    print(f"[DEBUG] process_single_image called with prompt: {repr(prompt)}")
+    print(f"[DEBUG] Prompt length: {len(prompt)} characters")
+    print(f"[DEBUG] Prompt starts with <image>: {prompt.startswith('<image>')}")
+    
+    # Create request format for vLLM
+    request_item = build_request(image, prompt)
     
     print(f"[DEBUG] Request item prompt: {repr(request_item['prompt'])}")
     print(f"[DEBUG] Request item keys: {list(request_item.keys())}")
@@ -173,18 +267,84 @@ def process_single_image(image: Image.Image, prompt: str = PROMPT) -> str:
     print(f"[DEBUG] Model output (first 100 chars): {repr(result[:100])}")
     print(f"[DEBUG] Model output length: {len(result)} characters")
     
-    # Clean up result
-    if '<｜end▁of▁sentence｜>' in result:
-        result = result.replace('<｜end▁of▁sentence｜>', '')
-        print(f"[DEBUG] Removed end-of-sentence tokens")
+    return clean_result(result)
+
+def process_images(images: List[Image.Image], prompt: str = PROMPT) -> List[str]:
+    """
+    Process several images in a single vLLM call.
+
+    All pages are handed to the engine at once so the scheduler can decode up to
+    max_num_seqs of them concurrently instead of one page per generate() call.
+    """
+    # Resize/tile/normalize pages on NUM_WORKERS threads; map() keeps page order
+    with ThreadPoolExecutor(max_workers=max(1, min(NUM_WORKERS, len(images)))) as executor:
+        batch_inputs = list(executor.map(lambda image: build_request(image, prompt), images))
+    print(f"[DEBUG] Sending {len(batch_inputs)} requests to vLLM in one batch...")
+    outputs = llm.generate(batch_inputs, sampling_params=sampling_params)
+    return [clean_result(output.outputs[0].text) for output in outputs]
+
+def page_error(page_idx: int, error: Exception) -> OCRResponse:
+    """Result entry for a page that could not be rendered or recognized"""
+    print(f"[ERROR] Page {page_idx + 1} failed: {str(error)}")
+    return OCRResponse(
+        success=False,
+        error=f"Page {page_idx + 1} error: {str(error)}",
+        page_count=page_idx + 1
+    )
+
+def ocr_page_batch(batch: list, prompt: str, results: dict):
+    """OCR a batch of (page_idx, image) pairs into results; a failing batch is retried page by page"""
+    try:
+        texts = process_images([image for _, image in batch], prompt)
+    except Exception as e:
+        print(f"[ERROR] Batch of {len(batch)} pages failed ({str(e)}), retrying pages one at a time")
+        texts = None
     
-    return result
+    for i, (page_idx, image) in enumerate(batch):
+        try:
+            text = texts[i] if texts is not None else process_single_image(image, prompt)
+        except Exception as e:
+            results[page_idx] = page_error(page_idx, e)
+            continue
+        results[page_idx] = OCRResponse(success=True, result=text, page_count=page_idx + 1)
+
+def process_pdf_pages(pdf_data: bytes, prompt: str = PROMPT, dpi: int = 144) -> List[OCRResponse]:
+    """
+    OCR every page of a PDF, overlapping rasterization with inference.
+
+    Pages are handed to vLLM MAX_CONCURRENCY at a time. The batch fills from the
+    render pool's small look-ahead window, which keeps rendering the next pages
+    while a batch is being recognized. Each page gets its own result, so a page that fails to
+    render or OCR does not fail the rest of the document.
+    """
+    results = {}
+    batch = []
+    for page_idx, image in iter_pdf_images(pdf_data, dpi):
+        if isinstance(image, Exception):
+            results[page_idx] = page_error(page_idx, image)
+            continue
+        batch.append((page_idx, image))
+        if len(batch) == MAX_CONCURRENCY:
+            ocr_page_batch(batch, prompt, results)
+            batch = []
+            print(f"[DEBUG] OCR complete for {len(results)} pages so far")
+    if batch:
+        ocr_page_batch(batch, prompt, results)
+    
+    return [results[page_idx] for page_idx in sorted(results)]
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the model on startup"""
+    """Start the render pool and initialize the model on startup"""
+    start_render_pool()
     initialize_model()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the render pool"""
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -254,11 +414,16 @@ async def process_pdf_endpoint(file: UploadFile = File(...), prompt: Optional[st
         pdf_data = await file.read()
         print(f"[DEBUG] Read {len(pdf_data)} bytes of PDF data")
         
-        # Convert PDF to images
-        images = pdf_to_images_high_quality(pdf_data, dpi=144)
-        print(f"[DEBUG] Converted PDF to {len(images)} images")
+        # Use provided prompt or default
+        use_prompt = prompt if prompt else PROMPT
+        print(f"[DEBUG] PDF endpoint selected prompt: {repr(use_prompt)}")
+        print(f"[DEBUG] Using custom prompt: {prompt is not None}")
         
-        if not images:
+        # Rasterize and OCR pages concurrently; vLLM decodes each batch of pages together
+        results = process_pdf_pages(pdf_data, use_prompt, dpi=144)
+        print(f"[DEBUG] Processed {len(results)} pages")
+        
+        if not results:
             print(f"[DEBUG] No images extracted from PDF")
             return BatchOCRResponse(
                 success=False,
@@ -267,36 +432,15 @@ async def process_pdf_endpoint(file: UploadFile = File(...), prompt: Optional[st
                 filename=file.filename
             )
         
-        # Use provided prompt or default
-        use_prompt = prompt if prompt else PROMPT
-        print(f"[DEBUG] PDF endpoint selected prompt: {repr(use_prompt)}")
-        print(f"[DEBUG] Using custom prompt: {prompt is not None}")
-        
-        # Process each page
-        results = []
-        for page_num, image in enumerate(tqdm(images, desc="Processing pages")):
-            try:
-                print(f"[DEBUG] Processing page {page_num + 1}/{len(images)}")
-                result = process_single_image(image, use_prompt)
-                results.append(OCRResponse(
-                    success=True,
-                    result=result,
-                    page_count=page_num + 1
-                ))
-                print(f"[DEBUG] Page {page_num + 1} processed successfully, output length: {len(result)}")
-            except Exception as e:
-                print(f"[ERROR] Page {page_num + 1} failed: {str(e)}")
-                results.append(OCRResponse(
-                    success=False,
-                    error=f"Page {page_num + 1} error: {str(e)}",
-                    page_count=page_num + 1
-                ))
+        for page in results:
+            if page.success:
+                print(f"[DEBUG] Page {page.page_count} processed successfully, output length: {len(page.result)}")
         
         print(f"[DEBUG] PDF processing complete: {len(results)} pages processed")
         return BatchOCRResponse(
             success=True,
             results=results,
-            total_pages=len(images),
+            total_pages=len(results),
             filename=file.filename
         )
         
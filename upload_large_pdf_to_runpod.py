@@ -4,13 +4,25 @@ Enhanced PDF Upload to RunPod DeepSeek-OCR API
 Supports large PDFs via chunked upload or URL-based upload
 """
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import pybase64 as b64  # Optional SIMD base64 encoder, much faster on large chunks
+except ImportError:
+    import base64 as b64
 import json
+try:
+    import orjson  # Optional: faster for the large results returned by finished jobs
+except ImportError:
+    orjson = None
 import sys
 import os
 import uuid
-import math
+import time
+import mmap
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pathlib import Path
+from urllib.parse import quote
 
 # Configuration
 PDF_PATH = os.environ.get("PDF_PATH", "/path/to/your/file.pdf")
@@ -18,9 +30,51 @@ API_KEY = os.environ.get("RUNPOD_API_KEY", "your_api_key_here")
 ENDPOINT_ID = os.environ.get("RUNPOD_ENDPOINT_ID", "your_endpoint_id")
 BASE_URL = f"https://api.runpod.ai/v2/{ENDPOINT_ID}"
 
+# Request headers for the RunPod API (only sent to BASE_URL, never to file hosts)
+AUTH_HEADERS = {'Authorization': f'Bearer {API_KEY}'}
+JSON_HEADERS = {**AUTH_HEADERS, 'Content-Type': 'application/json'}
+
 # Upload settings
-CHUNK_SIZE_MB = 5  # 5 MB chunks (well under 10 MiB limit)
+# 7 MB is the largest whole-MB chunk whose base64 (~9.3 MB) stays under the 10 MiB request limit
+CHUNK_SIZE_MB = int(os.environ.get("CHUNK_SIZE_MB", "7"))
 CHUNK_SIZE_BYTES = CHUNK_SIZE_MB * 1024 * 1024
+UPLOAD_WORKERS = 8  # Chunks uploaded in parallel (also the number held in memory)
+JOB_POLL_INTERVAL = 2  # Seconds between status checks while waiting for chunk jobs
+
+
+def make_session(retry):
+    """Session with a pooled HTTPS adapter, so connections (and TLS handshakes) are reused"""
+    http = requests.Session()
+    http.mount('https://', HTTPAdapter(pool_connections=UPLOAD_WORKERS, pool_maxsize=UPLOAD_WORKERS,
+                                       max_retries=retry))
+    return http
+
+
+# Status checks and file-host uploads are safe to repeat, so failed connections,
+# rate limiting and transient server errors are retried with exponential backoff
+session = make_session(Retry(
+    total=5,
+    backoff_factor=1.0,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=['GET', 'PUT'],
+    respect_retry_after_header=True,
+    raise_on_status=False  # Hand the last response back for the usual error reporting
+))
+
+# Every POST to /run queues a job (each chunk, a PDF URL), so these are only
+# retried when the job cannot have been queued: failed connections and 429
+# rejections. A timeout or 5xx may come after the job was queued, and a retry
+# would run it twice; a duplicate chunk job could even land after the upload
+# was assembled and leave a stray chunk behind.
+job_session = make_session(Retry(
+    total=5,
+    read=0,
+    backoff_factor=1.0,
+    status_forcelist=[429],
+    allowed_methods=['POST'],
+    respect_retry_after_header=True,
+    raise_on_status=False
+))
 
 
 def get_file_size_mb(file_path):
@@ -29,6 +83,77 @@ def get_file_size_mb(file_path):
     return size_bytes / (1024 * 1024)
 
 
+def parse_json(response):
+    """Decode a JSON response body"""
+    return orjson.loads(response.content) if orjson else response.json()
+
+
+def format_json(data):
+    """Pretty-print JSON data for display"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(data, indent=2)
+
+
+def build_chunk_body(chunk_base64, **fields):
+    """
+    Build the JSON request body for one chunk as bytes
+    The base64 data is spliced in as-is (base64 never needs JSON escaping),
+    so it is not decoded to str and copied again by json serialization
+    """
+    fields_json = json.dumps(fields).encode('utf-8')  # b'{"chunk_id": ..., ...}'
+    return b''.join((b'{"input": {"chunk_data": "', chunk_base64, b'", ', fields_json[1:], b'}'))
+
+
+def post_chunk(chunk_base64, chunk_fields):
+    """
+    Send one chunk to the endpoint
+    Returns the response, or None if the chunk was rejected
+    """
+    response = job_session.post(
+        f"{BASE_URL}/run",
+        headers=JSON_HEADERS,
+        data=build_chunk_body(chunk_base64, **chunk_fields),
+        timeout=300
+    )
+
+    # A single progress line per chunk, written once its upload finishes
+    print(f"Chunk {chunk_fields['chunk_index'] + 1}/{chunk_fields['total_chunks']} "
+          f"({len(chunk_base64) / (1024 * 1024):.2f} MB base64): {response.status_code}")
+
+    if response.status_code != 200:
+        print(f"ERROR: {response.status_code}")
+        print(response.text)
+        return None
+
+    return response
+
+
+def wait_for_job(job_id):
+    """
+    Poll a RunPod job until it finishes
+    Returns the final status, or None if the job did not complete successfully
+    """
+    while True:
+        status = check_job_status(job_id)
+        if status is None:
+            return None
+
+        state = status.get('status')
+        if state == 'COMPLETED':
+            output = status.get('output')
+            if isinstance(output, dict) and 'error' in output:
+                print(f"ERROR: Job {job_id} failed: {output['error']}")
+                return None
+            return status
+        if state in ('FAILED', 'CANCELLED', 'TIMED_OUT'):
+            print(f"ERROR: Job {job_id} ended with status {state}")
+            print(format_json(status))
+            return None
+
+        time.sleep(JOB_POLL_INTERVAL)
+
+
 def upload_chunked(pdf_path, prompt=None):
     """
     Upload large PDF in chunks
@@ -40,15 +165,11 @@ def upload_chunked(pdf_path, prompt=None):
     print(f"Reading PDF: {pdf_path}")
 
     try:
-        # Read PDF
-        with open(pdf_path, 'rb') as f:
-            pdf_data = f.read()
-
-        file_size = len(pdf_data)
+        file_size = os.path.getsize(pdf_path)
         file_size_mb = file_size / (1024 * 1024)
 
         # Calculate chunks
-        total_chunks = math.ceil(file_size / CHUNK_SIZE_BYTES)
+        total_chunks = (file_size + CHUNK_SIZE_BYTES - 1) // CHUNK_SIZE_BYTES
         chunk_id = str(uuid.uuid4())
 
         print(f"PDF size: {file_size:,} bytes ({file_size_mb:.2f} MB)")
@@ -57,63 +178,77 @@ def upload_chunked(pdf_path, prompt=None):
         print(f"Upload ID: {chunk_id}")
         print()
 
-        # Upload each chunk
-        for i in range(total_chunks):
-            start = i * CHUNK_SIZE_BYTES
-            end = min((i + 1) * CHUNK_SIZE_BYTES, file_size)
-            chunk_data = pdf_data[start:end]
-            chunk_base64 = base64.b64encode(chunk_data).decode('utf-8')
-
-            chunk_size_mb = len(chunk_data) / (1024 * 1024)
-            chunk_base64_mb = len(chunk_base64) / (1024 * 1024)
-
-            print(f"Uploading chunk {i+1}/{total_chunks} "
-                  f"({chunk_size_mb:.2f} MB, base64: {chunk_base64_mb:.2f} MB)...")
+        if total_chunks == 0:
+            print("ERROR: PDF file is empty")
+            return None
 
-            payload = {
-                'input': {
+        # Upload chunks in parallel, encoding the PDF one chunk at a time and
+        # keeping at most UPLOAD_WORKERS chunks in flight
+        pending = set()
+        chunk_job_ids = []
+
+        def accept_chunks(futures):
+            """Record the job IDs of finished chunk posts; False if any chunk was rejected"""
+            for future in futures:
+                response = future.result()
+                if response is None:
+                    return False
+                chunk_job_ids.append(parse_json(response)['id'])
+            return True
+
+        # The PDF is memory-mapped and each chunk is encoded straight from
+        # a view of the mapping, so file data is never copied into Python buffers.
+        # Every view is released before the mapping is closed on the way out.
+        with open(pdf_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map, \
+                memoryview(pdf_map) as pdf_view, \
+                ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            for i in range(total_chunks):
+                with pdf_view[i * CHUNK_SIZE_BYTES:(i + 1) * CHUNK_SIZE_BYTES] as chunk_data:
+                    chunk_base64 = b64.b64encode(chunk_data)
+
+                chunk_fields = {
                     'chunk_id': chunk_id,
                     'chunk_index': i,
-                    'total_chunks': total_chunks,
-                    'chunk_data': chunk_base64
+                    'total_chunks': total_chunks
                 }
-            }
-
-            # Add prompt on last chunk
-            if i == total_chunks - 1 and prompt:
-                payload['input']['prompt'] = prompt
-
-            response = requests.post(
-                f"{BASE_URL}/run",
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {API_KEY}'
-                },
-                json=payload,
-                timeout=300
-            )
-
-            print(f"Response: {response.status_code}")
-
-            if response.status_code != 200:
-                print(f"ERROR: {response.status_code}")
-                print(response.text)
-                return None
 
-            result = response.json()
+                if i < total_chunks - 1:
+                    if len(pending) >= UPLOAD_WORKERS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        if not accept_chunks(done):
+                            return None
+                    pending.add(executor.submit(post_chunk, chunk_base64, chunk_fields))
+                    continue
+
+                if not accept_chunks(as_completed(pending)):
+                    return None
+
+                # A 200 from /run only means a chunk's job was queued. The last
+                # chunk carries the prompt and must be the one that completes the
+                # set and starts OCR, so it is only sent once every other chunk's
+                # job has finished storing its chunk.
+                if chunk_job_ids:
+                    print(f"Waiting for the workers to store {len(chunk_job_ids)} chunk(s)...")
+                for job_id in chunk_job_ids:
+                    if wait_for_job(job_id) is None:
+                        return None
+
+                # Add prompt on last chunk
+                if prompt:
+                    chunk_fields['prompt'] = prompt
+
+                response = post_chunk(chunk_base64, chunk_fields)
+                if response is None:
+                    return None
+
+                result = parse_json(response)
 
-            # Check if this is the final response
-            if i == total_chunks - 1:
                 print(f"\n{'='*60}")
                 print("ALL CHUNKS UPLOADED SUCCESSFULLY!")
                 print(f"{'='*60}")
-                print(json.dumps(result, indent=2))
+                print(format_json(result))
                 return result
-            else:
-                # Intermediate chunk response
-                if 'status' in result:
-                    print(f"  → {result.get('message', 'Chunk received')}")
-                print()
 
         return None
 
@@ -151,12 +286,9 @@ def upload_via_url(pdf_url, prompt=None):
         if prompt:
             payload['input']['prompt'] = prompt
 
-        response = requests.post(
+        response = job_session.post(
             f"{BASE_URL}/run",
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {API_KEY}'
-            },
+            headers=JSON_HEADERS,
             json=payload,
             timeout=600  # 10 minutes for large files
         )
@@ -164,11 +296,11 @@ def upload_via_url(pdf_url, prompt=None):
         print(f"\nResponse Status: {response.status_code}")
 
         if response.status_code == 200:
-            result = response.json()
+            result = parse_json(response)
             print(f"\n{'='*60}")
             print("SUCCESS!")
             print(f"{'='*60}")
-            print(json.dumps(result, indent=2))
+            print(format_json(result))
             return result
         else:
             print(f"\nERROR: {response.status_code}")
@@ -194,11 +326,13 @@ def upload_to_transfer_sh(pdf_path):
     try:
         filename = os.path.basename(pdf_path)
 
+        # PUT the file as the raw request body so it is streamed from disk
+        # rather than buffered in memory for multipart encoding
         with open(pdf_path, 'rb') as f:
-            response = requests.post(
-                'https://transfer.sh/',
-                files={filename: f},
-                timeout=300
+            response = session.put(
+                f'https://transfer.sh/{quote(filename)}',
+                data=f,
+                timeout=600
             )
 
         if response.status_code == 200:
@@ -219,16 +353,14 @@ def upload_to_transfer_sh(pdf_path):
 def check_job_status(job_id):
     """Check the status of a RunPod job"""
     try:
-        response = requests.get(
+        response = session.get(
             f"{BASE_URL}/status/{job_id}",
-            headers={
-                'Authorization': f'Bearer {API_KEY}'
-            },
+            headers=AUTH_HEADERS,
             timeout=30
         )
 
         if response.status_code == 200:
-            return response.json()
+            return parse_json(response)
         else:
             print(f"ERROR checking status: {response.status_code}")
             print(response.text)
@@ -266,7 +398,7 @@ def main():
     # Let user choose
     print(f"\n{'='*60}")
     print("Choose upload method:")
-    print("  1. Chunked upload (splits file into 5MB chunks)")
+    print(f"  1. Chunked upload (splits file into {CHUNK_SIZE_MB}MB chunks)")
     print("  2. URL-based upload (via transfer.sh)")
     print("  3. URL-based upload (provide your own URL)")
     print(f"{'='*60}")
@@ -308,7 +440,7 @@ def main():
             print("\nChecking status...")
             status = check_job_status(job_id)
             if status:
-                print(json.dumps(status, indent=2))
+                print(format_json(status))
 
 
 if __name__ == "__main__":